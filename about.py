@@ -6,17 +6,26 @@ about_text = f"""
 
             <h3>Basic Controls</h3>
             <ul>
-                <li><strong>📂Load Image</strong> - Open an image file from your computer</li>
+                <li><strong>📂Load Image</strong> - Open an image file from your computer, select several to work on a set of images</li>
                 <li><strong>💾Save Image</strong> - Save the converted image to your computer</li>
+                <li><strong>💾Save All</strong> - Convert every opened image with the current settings into a folder</li>
+                <li><strong>Thumbnails</strong> - When several images are open, click a thumbnail below the images to show it</li>
+                <li><strong>📐Export Sizes</strong> - Save 320 to 1920 px wide versions for a responsive website into a folder, with a srcset manifest (JSON and HTML)</li>
                 <li><strong>➕/➖</strong> - Zoom in and out of the images</li>
-                <li><strong>Quality Slider</strong> - Adjust the compression quality (higher values = better quality but larger file size)</li>
-                <li><strong>Drag and Drop</strong> - You can also drag image files directly onto the main window to open them</li>
+                <li><strong>Quality Slider</strong> - Adjust the compression quality (higher values = better quality but larger file size). The size is estimated from sample tiles first (~), then replaced by the exact converted size</li>
+                <li><strong>Drag and Drop</strong> - You can also drag image files or folders directly onto the main window to open them</li>
+                <li><strong>Animations</strong> - Animated GIF and WebP images are saved as animated WebP. The first frame is shown as soon as it's converted and the expected size is updated while the remaining frames are encoded</li>
             </ul>
 
             <h3>Advanced Options</h3>
             <ul>
-                <li><strong>Method</strong> - Select the conversion algorithm (0-6). Higher values provide better quality and smaller file size but take longer to process.</li>
+                <li><strong>Method</strong> - Select the conversion algorithm (0-6). Higher values provide better quality and smaller file size but take longer to process. While the quality slider is dragged a fast draft (method 0) is shown, the chosen method replaces it when you stop.</li>
                 <li><strong>Lossless</strong> - Enable for lossless compression (no quality loss, but larger file size)</li>
+                <li><strong>Target size</strong> - Find the highest quality that fits the given size in KB. The image is downscaled if it doesn't fit even at the lowest quality</li>
+                <li><strong>Progressive</strong> - Show the visible part of a large image first, the full image replaces it when it's ready</li>
+                <li><strong>PSNR / SSIM</strong> - Below the converted image: how close it is to the original (higher is closer, SSIM 1.0 = identical). Measured on a reduced copy while you adjust the settings and on the full image when you save</li>
+                <li><strong>Heatmap</strong> - Highlight where the converted image differs from the original, red marks the largest loss of detail</li>
+                <li><strong>Timing overlay</strong> - The top left corner of the converted image shows how long the last preview took with the median (p50) and p95 of recent previews, hover it for the time spent in every stage</li>
             </ul>
 
             <h3>Image Navigation</h3>
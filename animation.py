@@ -0,0 +1,208 @@
+"""Streaming conversion of animated GIF/WebP to animated WebP with bounded memory.
+
+Usage: python animation.py banner.gif -o banner.webp -q 80 -m 4
+
+Frames are decoded one at a time. Every frame is encoded as a still WebP of the region that changed since the
+previous frame, and its bitstream is written into an ANMF chunk of the output right away. Only the current and
+the previous frame are held in memory, however long the animation is.
+"""
+import argparse
+import io
+import logging
+import os
+import struct
+import sys
+from collections import namedtuple
+from time import perf_counter
+
+from PIL import Image, ImageChops
+
+from converter_core import add_encoder_arguments, encode_image, encoder_mode, peak_rss_mb, reset_peak_rss
+from timing import span
+
+logger = logging.getLogger(__name__)
+
+# Frame chunks copied from the still WebP encodes, VP8X and metadata chunks are left out
+FRAME_CHUNKS = (b'ALPH', b'VP8 ', b'VP8L')
+VP8X_ANIMATION = 0x02
+VP8X_ALPHA = 0x10
+# ANMF flags: don't blend with the previous canvas, don't dispose, so a frame region replaces what was there
+ANMF_NO_BLEND = 0x02
+DEFAULT_DURATION = 100  # ms, for frames that don't specify one
+HEADER_SIZE = 12 + 18 + 14  # RIFF header, VP8X and ANIM chunks
+ANMF_OVERHEAD = 8 + 16  # Chunk header and frame header of every frame
+
+AnimationResult = namedtuple('AnimationResult', 'frames size canvas frame_seconds peak_mb')
+AnimationResult.__doc__ = """Outcome of an animation conversion.
+
+frames is the number of frames written (identical consecutive frames are merged), size the output size in bytes,
+canvas the (width, height), frame_seconds the encode time of every frame and peak_mb the peak RSS of the process.
+"""
+
+
+class Cancelled(Exception):
+    """Raised when the progress callback asked to stop."""
+
+
+def is_animated(image_path):
+    """True for files with more than one frame (animated GIF or WebP)."""
+    with Image.open(image_path) as src:
+        return getattr(src, 'is_animated', False)
+
+
+def frames(src):
+    """Yield (RGBA frame, duration in ms) of an opened animated image, one decoded frame at a time."""
+    for index in range(getattr(src, 'n_frames', 1)):
+        src.seek(index)
+        yield src.convert("RGBA"), src.info.get('duration') or DEFAULT_DURATION
+
+
+def changed_box(previous, frame):
+    """Region of frame that differs from previous with an even left/top (ANMF offsets are stored halved).
+
+    None when the frames are identical.
+    """
+    box = ImageChops.difference(previous, frame).getbbox(alpha_only=False)
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    return left & ~1, top & ~1, right, bottom
+
+
+def _chunk(fourcc, payload):
+    return fourcc + struct.pack('<I', len(payload)) + payload + (b'\0' if len(payload) % 2 else b'')
+
+
+def _uint24(value):
+    return struct.pack('<I', value)[:3]
+
+
+def frame_bitstream(webp_data):
+    """ALPH/VP8/VP8L chunks of a still WebP file, as they go into an ANMF chunk."""
+    chunks = []
+    position = 12  # After RIFF size WEBP
+    while position + 8 <= len(webp_data):
+        fourcc = webp_data[position:position + 4]
+        size = struct.unpack('<I', webp_data[position + 4:position + 8])[0]
+        end = position + 8 + size + (size & 1)
+        if fourcc in FRAME_CHUNKS:
+            chunks.append(webp_data[position:end])
+        position = end
+    return b''.join(chunks)
+
+
+def encode_animation(image_path, out, quality, method, lossless, progress=None):
+    """Write image_path as an animated WebP to the seekable binary file out, returns an AnimationResult.
+
+    progress(index, count, written, estimate, frame_webp) is called after every encoded frame: written is the
+    output size so far, estimate the expected final size and frame_webp the still WebP of the frame region
+    (the full first frame for index 0). If it returns False the conversion stops with Cancelled.
+    """
+    reset_peak_rss()
+    frame_seconds = []
+    with Image.open(image_path) as src:
+        width, height = src.size
+        count = getattr(src, 'n_frames', 1)
+        loop = src.info.get('loop', 0)
+
+        start = out.tell()
+        out.write(b'RIFF\0\0\0\0WEBP')
+        vp8x_flags = start + 20  # Flags byte of the VP8X payload, patched when alpha is known
+        out.write(_chunk(b'VP8X', bytes([VP8X_ANIMATION, 0, 0, 0]) + _uint24(width - 1) + _uint24(height - 1)))
+        out.write(_chunk(b'ANIM', bytes([0, 0, 0, 0]) + struct.pack('<H', loop)))
+
+        has_alpha = False
+        previous = None
+        pending = None  # [left, top, width, height, duration, bitstream] of the frame waiting for its duration
+        written = 0
+        encoded = first = 0  # Bytes of all frames encoded so far and of the first, full canvas one
+        for index, (frame, duration) in enumerate(frames(src)):
+            box = (0, 0, width, height) if previous is None else changed_box(previous, frame)
+            if box is None:
+                pending[4] += duration  # Same picture, show the previous frame longer
+                previous = frame
+                continue
+            region = encoder_mode(frame.crop(box) if box != (0, 0, width, height) else frame)
+            has_alpha = has_alpha or region.mode == "RGBA"
+            encode_start = perf_counter()
+            with span("frame encode", index=index):
+                frame_webp = encode_image(region, quality, method, lossless)
+            frame_seconds.append(perf_counter() - encode_start)
+            if pending is not None:
+                written += _write_frame(out, *pending)
+            pending = [box[0], box[1], box[2] - box[0], box[3] - box[1], duration, frame_bitstream(frame_webp)]
+            previous = frame
+
+            # Later frames only hold what changed, so they are averaged without the first one
+            encoded += len(pending[5]) + ANMF_OVERHEAD
+            if index == 0:
+                first = encoded
+                estimate = HEADER_SIZE + first * count
+            else:
+                estimate = round(HEADER_SIZE + first + (encoded - first) / index * (count - 1))
+            if progress is not None and progress(index, count, written, estimate, frame_webp) is False:
+                raise Cancelled()
+        written += _write_frame(out, *pending)
+
+    end = out.tell()
+    out.seek(start + 4)
+    out.write(struct.pack('<I', end - start - 8))
+    if has_alpha:
+        out.seek(vp8x_flags)
+        out.write(bytes([VP8X_ANIMATION | VP8X_ALPHA]))
+    out.seek(end)
+    result = AnimationResult(len(frame_seconds), end - start, (width, height), frame_seconds, peak_rss_mb())
+    logger.info("%s: %d frames, frame encode mean %.1f ms, max %.1f ms, peak RSS %.0f MB", image_path,
+                result.frames, sum(frame_seconds) / len(frame_seconds) * 1000, max(frame_seconds) * 1000,
+                result.peak_mb)
+    return result
+
+
+def _write_frame(out, left, top, width, height, duration, bitstream):
+    header = (_uint24(left // 2) + _uint24(top // 2) + _uint24(width - 1) + _uint24(height - 1)
+              + _uint24(min(duration, 0xFFFFFF)) + bytes([ANMF_NO_BLEND]))
+    chunk = _chunk(b'ANMF', header + bitstream)
+    out.write(chunk)
+    return len(chunk)
+
+
+def animation_to_webp(image_path, quality, method, lossless, progress=None):
+    """Animated WebP bytes of an animated image."""
+    buffer = io.BytesIO()
+    encode_animation(image_path, buffer, quality, method, lossless, progress)
+    return buffer.getvalue()
+
+
+def convert_animation(image_path, save_path, quality, method, lossless, progress=None):
+    """Convert an animated image file, the output is written while the frames are encoded."""
+    with open(save_path, 'wb') as f:
+        return encode_animation(image_path, f, quality, method, lossless, progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert an animated GIF or WebP to animated WEBP.")
+    parser.add_argument('image', help="animated GIF or WebP")
+    parser.add_argument('-o', '--output', help="output file, default is next to the source")
+    add_encoder_arguments(parser, method_default=4)
+    args = parser.parse_args(argv)
+
+    save_path = args.output or os.path.splitext(args.image)[0] + '.webp'
+    if os.path.abspath(save_path) == os.path.abspath(args.image):
+        print("Output would overwrite the source, use -o")
+        return 2
+
+    def report(index, count, written, estimate, frame_webp):
+        print(f"\rframe {index + 1}/{count}, ~{estimate / 1024:.1f} KB expected", end='', flush=True)
+
+    start = perf_counter()
+    result = convert_animation(args.image, save_path, args.quality, args.method, args.lossless, report)
+    seconds = result.frame_seconds
+    print(f"\n{args.image} -> {save_path}: {result.frames} frames {result.canvas[0]}x{result.canvas[1]}, "
+          f"{result.size / 1024:.1f} KB in {perf_counter() - start:.2f} s")
+    print(f"Frame encode: mean {sum(seconds) / len(seconds) * 1000:.1f} ms, max {max(seconds) * 1000:.1f} ms, "
+          f"peak RSS {result.peak_mb:.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
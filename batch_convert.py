@@ -0,0 +1,194 @@
+"""Headless batch conversion of JPG/PNG/BMP/GIF images to WEBP, animations stay animated.
+
+Usage: python batch_convert.py photos/ extra.png -o out/ -q 80 -m 6 -j 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from time import perf_counter
+
+from animation import convert_animation, is_animated
+from converter_core import (add_encoder_arguments, collect_images, convert_file, encode_image, load_image,
+                            output_path, peak_rss_mb, reset_peak_rss)
+from quality_metrics import format_metrics, webp_quality
+from target_size import find_quality_for_size
+from timing import percentile
+
+
+def _convert_job(image_path, save_path, quality, method, lossless, target_kb=None, max_dimension=None, metrics=False):
+    """Runs in a worker process, never raises so one broken file doesn't stop the batch.
+
+    Returns (image_path, save_path, input size, output size, seconds, error, detail, peak RSS in MB,
+    QualityMetrics or None). With metrics, PSNR and SSIM are computed at full resolution.
+    Animated GIF/WebP files are converted frame by frame at their size, target_kb and metrics don't apply to them.
+    """
+    start = perf_counter()
+    detail = ''
+    quality_metrics = None
+    reset_peak_rss()
+    try:
+        os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
+        if is_animated(image_path):
+            if target_kb:
+                raise ValueError("target size isn't supported for animations")
+            webp_data = img = None
+            animation = convert_animation(image_path, save_path, quality, method, lossless)
+            out_size = animation.size
+            detail = (f"{animation.frames} frames, {sum(animation.frame_seconds) / animation.frames * 1000:.0f} ms "
+                      f"per frame")
+        elif target_kb:
+            # Files already run in parallel processes, so the probes of one file run one at a time
+            img = load_image(image_path, max_dimension)
+            result = find_quality_for_size(img, target_kb * 1024, method, parallel=1)
+            webp_data = result.data
+            detail = f"quality {result.quality}, {result.encodes} encodes"
+            if result.scale < 1:
+                detail += f", downscaled to {result.size[0]}x{result.size[1]}"
+            if not result.fits:
+                detail += ", DOES NOT FIT"
+        elif metrics:
+            img = load_image(image_path, max_dimension)
+            webp_data = encode_image(img, quality, method, lossless)
+        else:
+            webp_data = img = None
+            out_size = convert_file(image_path, save_path, quality, method, lossless, max_dimension)
+        if webp_data is not None:
+            with open(save_path, 'wb') as f:
+                f.write(webp_data)
+            out_size = len(webp_data)
+        if metrics and img is not None:
+            quality_metrics = webp_quality(img, webp_data)
+            detail = ", ".join(part for part in (detail, format_metrics(quality_metrics)) if part)
+        return (image_path, save_path, os.path.getsize(image_path), out_size, perf_counter() - start, None, detail,
+                peak_rss_mb(), quality_metrics)
+    except Exception as e:
+        return image_path, save_path, 0, 0, perf_counter() - start, str(e), detail, peak_rss_mb(), None
+
+
+def run_batch(jobs, quality, method, lossless, workers=None, max_in_flight=None, report=print, target_kb=None,
+              max_dimension=None, metrics=False):
+    """Convert (image_path, save_path) pairs in a process pool, returns the list of job results.
+
+    At most max_in_flight jobs are submitted at a time, so memory stays bounded for huge batches.
+    With target_kb every file gets the highest quality that fits the budget instead of a fixed quality,
+    with max_dimension larger images are downscaled while decoding. With metrics PSNR and SSIM of every file
+    are computed at full resolution.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    results = []
+    jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                pending.add(pool.submit(_convert_job, job[0], job[1], quality, method, lossless, target_kb,
+                                        max_dimension, metrics))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results.append(result)
+                image_path, save_path, in_size, out_size, seconds, error, detail, peak_mb, _ = result
+                if error:
+                    report(f"FAILED {image_path}: {error}")
+                else:
+                    detail = f", {detail}" if detail else ''
+                    report(f"{image_path} -> {save_path} {in_size / 1024:.1f} KB -> {out_size / 1024:.1f} KB "
+                           f"({seconds * 1000:.0f} ms, peak RSS {peak_mb:.0f} MB{detail})")
+    return results
+
+
+def summarize(results, wall_time):
+    converted = [r for r in results if r[5] is None]
+    failed = len(results) - len(converted)
+    latencies = [r[4] * 1000 for r in converted]
+    in_total = sum(r[2] for r in converted)
+    out_total = sum(r[3] for r in converted)
+    lines = [
+        f"Converted: {len(converted)}, failed: {failed}, wall time: {wall_time:.2f} s",
+        f"Size: {in_total / 1024 / 1024:.2f} MB -> {out_total / 1024 / 1024:.2f} MB",
+    ]
+    if wall_time > 0:
+        lines.append(f"Throughput: {len(converted) / wall_time:.2f} files/s, "
+                     f"{in_total / 1024 / 1024 / wall_time:.2f} MB/s input")
+    if latencies:
+        lines.append(f"Latency per file: p50 {percentile(latencies, 50):.0f} ms, "
+                     f"p95 {percentile(latencies, 95):.0f} ms, max {max(latencies):.0f} ms")
+        lines.append(f"Peak RSS per worker: max {max(r[7] for r in converted):.0f} MB")
+    measured = [r for r in converted if r[8] is not None]
+    if measured:
+        worst = min(measured, key=lambda r: r[8].ssim)
+        finite = [r[8].psnr for r in measured if r[8].psnr != float('inf')]
+        psnr = f"{sum(finite) / len(finite):.2f} dB" if finite else "inf"
+        lines.append(f"Quality: mean PSNR {psnr}, mean SSIM {sum(r[8].ssim for r in measured) / len(measured):.4f}, "
+                     f"lowest SSIM {worst[8].ssim:.4f} ({worst[0]})")
+    return "\n".join(lines)
+
+
+def plan_jobs(images, output_dir=None, overwrite=False):
+    """Pair (image_path, base_dir) of images with their output paths, returns (jobs, existing, sources).
+
+    jobs are the (image_path, save_path) to convert. existing are the ones left out because the output exists
+    already, with overwrite they are converted as well. sources are images whose output would be the image itself
+    (a WebP converted into its own folder), they are never converted.
+    """
+    jobs, existing, sources = [], [], []
+    for image_path, base_dir in images:
+        save_path = output_path(image_path, base_dir, output_dir)
+        if os.path.abspath(save_path) == os.path.abspath(image_path):
+            sources.append(image_path)
+        elif os.path.exists(save_path) and not overwrite:
+            existing.append((image_path, save_path))
+        else:
+            jobs.append((image_path, save_path))
+    return jobs, existing, sources
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert JPG/PNG/BMP/GIF images to WEBP.")
+    parser.add_argument('inputs', nargs='+', help="image files or directories")
+    parser.add_argument('-o', '--output-dir', help="output directory, default is next to the source file")
+    add_encoder_arguments(parser, jobs_help="worker processes")
+    parser.add_argument('--target-kb', type=float, default=None,
+                        help="pick the highest quality that fits this size in KB (overrides -q and --lossless)")
+    parser.add_argument('--max-dimension', type=int, default=None,
+                        help="downscale images whose longest side is larger than this many pixels")
+    parser.add_argument('--metrics', action='store_true',
+                        help="report PSNR and SSIM of every file against its source (full resolution)")
+    parser.add_argument('--no-recursive', action='store_true', help="don't descend into subdirectories")
+    parser.add_argument('--overwrite', action='store_true', help="overwrite existing output files")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    jobs, existing, sources = plan_jobs(collect_images(args.inputs, recursive=not args.no_recursive),
+                                        args.output_dir, args.overwrite)
+    if sources:
+        print(f"Skipped {len(sources)} WebP file(s) whose output would overwrite the source, use -o")
+    if existing:
+        print(f"Skipped {len(existing)} file(s) with existing output, use --overwrite to convert them again")
+    if not jobs:
+        print("Nothing to convert")
+        return 0
+
+    start = perf_counter()
+    results = run_batch(jobs, args.quality, args.method, args.lossless, workers=args.jobs, target_kb=args.target_kb,
+                        max_dimension=args.max_dimension, metrics=args.metrics)
+    print(summarize(results, perf_counter() - start))
+    return 1 if any(r[5] for r in results) else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
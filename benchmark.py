@@ -0,0 +1,394 @@
+"""Offline benchmark of the conversion hot paths over a generated image corpus.
+
+Usage: python benchmark.py -o results.json
+       python benchmark.py --quick -o new.json --baseline results.json --threshold 20
+
+The corpus (photos, a screenshot, an alpha PNG and a very large photo) is generated from a fixed seed, so runs on
+different commits measure the same pixels. With --baseline the exit code is 1 when a metric got worse than
+the threshold allows.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from statistics import median
+from time import perf_counter
+
+from PIL import Image, ImageDraw, ImageFilter, __version__ as pillow_version
+
+from batch_convert import _convert_job, run_batch
+from converter_core import encode_image, int_list, load_image
+from version import __version__
+
+SEED = 2025
+
+# name -> (kind, full size, --quick size)
+CORPUS = {
+    'photo.jpg': ('photo', (2400, 1600), (1200, 800)),
+    'portrait.jpg': ('photo', (1600, 2400), (800, 1200)),
+    'screenshot.png': ('screenshot', (1920, 1080), (960, 540)),
+    'alpha.png': ('alpha', (1024, 1024), (512, 512)),
+    'huge.jpg': ('photo', (8000, 6000), (4000, 3000)),
+}
+# Too slow for the full encode matrix, used for decode, preview and memory
+LARGE_FILES = ('huge.jpg',)
+
+QUALITIES = (50, 75, 90)
+METHODS = (0, 4, 6)
+QUICK_QUALITIES = (75,)
+QUICK_METHODS = (0, 4)
+
+# Metrics compared with --baseline: key -> True when a higher value is better
+COMPARED_VALUES = {'ms': False, 'peak_mb': False, 'files_per_s': True}
+
+
+def _noise(rng, size, blur=0):
+    img = Image.frombytes("L", size, rng.randbytes(size[0] * size[1]))
+    return img.filter(ImageFilter.GaussianBlur(blur)) if blur else img
+
+
+def make_photo(size, rng):
+    """Smooth colour gradients with large soft shapes and fine grain, compresses like a photo."""
+    channels = []
+    for angle in (0, 70, 140):
+        gradient = Image.linear_gradient("L").rotate(angle, resample=Image.Resampling.BICUBIC).resize(size)
+        shapes = _noise(rng, (max(2, size[0] // 64), max(2, size[1] // 64))).resize(size, Image.Resampling.BICUBIC)
+        channels.append(Image.blend(gradient, shapes, 0.6))
+    img = Image.merge("RGB", channels)
+    grain = Image.merge("RGB", [_noise(rng, size)] * 3)
+    return Image.blend(img, grain, 0.1)
+
+
+def make_screenshot(size, rng):
+    """Flat windows, title bars and lines of text on a plain background."""
+    img = Image.new("RGB", size, (236, 239, 244))
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        left, top = rng.randrange(size[0] * 2 // 3), rng.randrange(size[1] * 2 // 3)
+        right, bottom = left + rng.randrange(200, size[0] // 2), top + rng.randrange(150, size[1] // 2)
+        draw.rectangle((left, top, right, bottom), fill=(255, 255, 255), outline=(160, 160, 170))
+        draw.rectangle((left, top, right, top + 24), fill=tuple(rng.randrange(40, 200) for _ in range(3)))
+        for y in range(top + 34, bottom - 14, 16):
+            words = " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randrange(2, 9)))
+                             for _ in range(12))
+            draw.text((left + 8, y), words, fill=(30, 30, 30))
+    return img
+
+
+def make_alpha(size, rng):
+    """Photo content with a soft round alpha mask and fully transparent corners."""
+    img = make_photo(size, rng).convert("RGBA")
+    mask = Image.eval(Image.radial_gradient("L").resize(size), lambda v: 0 if v > 180 else 255 - v)
+    img.putalpha(mask)
+    return img
+
+
+GENERATORS = {'photo': make_photo, 'screenshot': make_screenshot, 'alpha': make_alpha}
+
+
+def build_corpus(directory, quick=False):
+    """Generate the corpus into directory unless it's there already, returns {name: path}."""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for index, (name, (kind, size, quick_size)) in enumerate(CORPUS.items()):
+        path = os.path.join(directory, name)
+        paths[name] = path
+        size = quick_size if quick else size
+        if os.path.exists(path):
+            with Image.open(path) as existing:
+                if existing.size == size:
+                    continue
+        img = GENERATORS[kind](size, random.Random(SEED + index))
+        if name.endswith('.jpg'):
+            img.save(path, quality=90)
+        else:
+            img.save(path)
+    return paths
+
+
+def timed(function, repeat):
+    """Median and all run times of function() in ms, plus its last return value."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        runs.append((perf_counter() - start) * 1000)
+    return {'ms': median(runs), 'runs': [round(run, 2) for run in runs]}, result
+
+
+def bench_decode(paths, repeat):
+    metrics = {}
+    for name, path in paths.items():
+        metrics[f"decode/{name}"], _ = timed(lambda: load_image(path), repeat)
+    return metrics
+
+
+def bench_encode(paths, qualities, methods, repeat):
+    metrics = {}
+    for name, path in paths.items():
+        if name in LARGE_FILES:
+            continue
+        img = load_image(path)
+        for lossless in (False, True):
+            for method in methods:
+                for quality in qualities:
+                    metric, data = timed(lambda: encode_image(img, quality, method, lossless), repeat)
+                    metric['bytes'] = len(data)
+                    mode = 'lossless' if lossless else 'lossy'
+                    metrics[f"encode/{name}/{mode}-q{quality}-m{method}"] = metric
+    return metrics
+
+
+def bench_preview(paths, quality, method, repeat):
+    """Latency from a request to the decoded preview, through ImageConversionWorker and Qt's offscreen platform.
+
+    cold: nothing cached, the source is decoded like after loading a file. warm: the decoded source is cached,
+    like moving the slider. cached: the same settings again, only the WebP data is decoded for display.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtCore import QEventLoop, QTimer
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    from image_cache import decoded_cache, encoded_cache
+    from image_converter2webp import ImageConversionWorker
+
+    worker = ImageConversionWorker()
+
+    def run(submit):
+        loop = QEventLoop()
+        timeout = QTimer()
+        timeout.setSingleShot(True)
+        timeout.timeout.connect(loop.quit)
+        results = []
+
+        def done(generation, *args):
+            if worker.is_current(generation):
+                results.append(args)
+                loop.quit()
+
+        worker.finished.connect(done)
+        worker.error.connect(done)
+        start = perf_counter()
+        submit()
+        timeout.start(600_000)
+        loop.exec()
+        elapsed = (perf_counter() - start) * 1000
+        worker.finished.disconnect(done)
+        worker.error.disconnect(done)
+        if not results or isinstance(results[0][0], str):
+            raise RuntimeError(f"preview failed: {results[0][0] if results else 'timed out'}")
+        return elapsed
+
+    def cold(path):
+        decoded_cache.clear()
+        encoded_cache.clear()
+        worker.request_load(path)
+        return run(lambda: worker.request(path, quality, method, False))
+
+    def warm(path):
+        encoded_cache.clear()
+        return run(lambda: worker.request(path, quality, method, False))
+
+    def cached(path):
+        return run(lambda: worker.request(path, quality, method, False))
+
+    metrics = {}
+    try:
+        for name, path in paths.items():
+            for kind, measure in (('cold', cold), ('warm', warm), ('cached', cached)):
+                runs = [measure(path) for _ in range(repeat)]
+                metrics[f"preview/{name}/{kind}"] = {'ms': median(runs), 'runs': [round(run, 2) for run in runs]}
+            app.processEvents()
+    finally:
+        worker.shutdown()
+        decoded_cache.clear()
+        encoded_cache.clear()
+    return metrics
+
+
+def bench_startup(repeat):
+    """Cold start of the GUI in a new process with --startup-profile, on Qt's offscreen platform.
+
+    process: wall time including the interpreter start, first window: from the first import until it's shown.
+    """
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_converter2webp.py')
+    process_runs, window_runs = [], []
+    for _ in range(repeat):
+        start = perf_counter()
+        output = subprocess.run([sys.executable, script, '--startup-profile'], env=env, capture_output=True,
+                                text=True, timeout=120).stdout
+        process_runs.append((perf_counter() - start) * 1000)
+        shown = re.search(r"first window shown (\d+) ms", output)
+        if shown is None:
+            raise RuntimeError(f"startup profile missing from the output: {output!r}")
+        window_runs.append(float(shown.group(1)))
+    return {
+        'startup/process': {'ms': median(process_runs), 'runs': [round(run, 2) for run in process_runs]},
+        'startup/first window': {'ms': median(window_runs), 'runs': window_runs},
+    }
+
+
+def bench_memory(paths, quality, method, output_dir):
+    """Peak RSS of converting every file in a fresh process, so earlier work doesn't count."""
+    metrics = {}
+    # Spawned, a forked process would start with the memory of this one
+    context = multiprocessing.get_context('spawn')
+    for name, path in paths.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(_convert_job, path, os.path.join(output_dir, name + '.webp'), quality, method,
+                                 False).result()
+        if result[5]:
+            raise RuntimeError(f"{name}: {result[5]}")
+        metrics[f"memory/{name}"] = {'peak_mb': round(result[7], 1)}
+    return metrics
+
+
+def bench_batch(paths, quality, method, worker_counts, files, output_dir):
+    """Throughput of run_batch() for every worker count, over copies of the small corpus files."""
+    sources = [path for name, path in paths.items() if name not in LARGE_FILES]
+    jobs = [(sources[i % len(sources)], os.path.join(output_dir, f"batch_{i}.webp")) for i in range(files)]
+    in_total = sum(os.path.getsize(source) for source, _ in jobs)
+    metrics = {}
+    for workers in worker_counts:
+        start = perf_counter()
+        results = run_batch(jobs, quality, method, False, workers=workers, report=lambda message: None)
+        wall = perf_counter() - start
+        failed = [r for r in results if r[5]]
+        if failed:
+            raise RuntimeError(f"batch: {failed[0][0]}: {failed[0][5]}")
+        metrics[f"batch/workers-{workers}"] = {'wall_s': wall, 'files_per_s': files / wall,
+                                               'mb_per_s': in_total / 1024 / 1024 / wall}
+    return metrics
+
+
+def compare(baseline, current, threshold, min_delta_ms=5.0):
+    """Metrics that got more than threshold percent worse than the baseline, as readable lines.
+
+    Timings that changed by less than min_delta_ms are ignored, they are within the noise of short runs.
+    """
+    regressions = []
+    for key, metric in current['metrics'].items():
+        old = baseline.get('metrics', {}).get(key)
+        if not old:
+            continue
+        for value, higher_is_better in COMPARED_VALUES.items():
+            if value not in metric or not old.get(value):
+                continue
+            change = (metric[value] - old[value]) / old[value] * 100
+            if higher_is_better:
+                change = -change
+            if value == 'ms' and abs(metric[value] - old[value]) < min_delta_ms:
+                continue
+            if change > threshold:
+                regressions.append(f"{key} {value}: {old[value]:.1f} -> {metric[value]:.1f} ({change:+.0f}% worse)")
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_parser():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark decode, encode, preview, startup, memory and batch "
+                                                 "throughput.")
+    parser.add_argument('-o', '--output', help="write the results as JSON to this file")
+    parser.add_argument('--corpus', help="directory of the generated corpus, reused when it exists "
+                                         "(default: a temporary directory)")
+    parser.add_argument('--quick', action='store_true', help="smaller images and a smaller encode matrix")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the median is reported")
+    # Not add_encoder_arguments(): lossless is part of the encode matrix, -q/-m only pick the other runs
+    parser.add_argument('-q', '--quality', type=int, default=80, help="quality of preview, memory and batch runs")
+    parser.add_argument('-m', '--method', type=int, default=4, choices=range(7),
+                        help="method of preview, memory and batch runs (default 4)")
+    parser.add_argument('--qualities', type=int_list, help="encode matrix qualities, e.g. 50,75,90")
+    parser.add_argument('--methods', type=int_list, help="encode matrix methods, e.g. 0,4,6")
+    parser.add_argument('--workers', type=int_list, default=sorted({1, 2, max(1, cpu_count // 2), cpu_count}),
+                        help="batch worker counts, e.g. 1,2,4 (default: 1, 2, half and all cores)")
+    parser.add_argument('--batch-files', type=int, default=16, help="files per batch run (default 16)")
+    parser.add_argument('--skip', type=lambda text: set(text.split(',')), default=set(),
+                        help="comma separated parts to leave out: decode,encode,preview,startup,memory,batch")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help="percent a metric may get worse than the baseline before the run fails (default 20)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    qualities = args.qualities or (QUICK_QUALITIES if args.quick else QUALITIES)
+    methods = args.methods or (QUICK_METHODS if args.quick else METHODS)
+    repeat = max(1, args.repeat)
+
+    with tempfile.TemporaryDirectory(prefix='webp_bench_') as scratch:
+        paths = build_corpus(args.corpus or os.path.join(scratch, 'corpus'), args.quick)
+        results = {
+            'meta': {
+                'version': __version__, 'commit': _git_commit(), 'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(), 'pillow': pillow_version, 'platform': platform.platform(),
+                'cpu_count': os.cpu_count(), 'quick': args.quick, 'repeat': repeat, 'seed': SEED,
+                'quality': args.quality, 'method': args.method,
+            },
+            'corpus': {},
+            'metrics': {},
+        }
+        for name, path in paths.items():
+            with Image.open(path) as img:
+                results['corpus'][name] = {'size': list(img.size), 'mode': img.mode, 'bytes': os.path.getsize(path)}
+
+        parts = [
+            ('decode', lambda: bench_decode(paths, repeat)),
+            ('encode', lambda: bench_encode(paths, qualities, methods, repeat)),
+            ('preview', lambda: bench_preview(paths, args.quality, args.method, repeat)),
+            ('startup', lambda: bench_startup(repeat)),
+            ('memory', lambda: bench_memory(paths, args.quality, args.method, scratch)),
+            ('batch', lambda: bench_batch(paths, args.quality, args.method, args.workers, args.batch_files, scratch)),
+        ]
+        for part, run in parts:
+            if part in args.skip:
+                continue
+            start = perf_counter()
+            metrics = run()
+            results['metrics'].update(metrics)
+            print(f"{part}: {len(metrics)} measurements in {perf_counter() - start:.1f} s")
+            for key, metric in metrics.items():
+                values = ", ".join(f"{value} {metric[value]:.1f}" for value in ('ms', 'peak_mb', 'files_per_s')
+                                   if value in metric)
+                print(f"  {key}: {values}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0f}% against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions over {args.threshold:.0f}% against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Latest-request-wins job scheduler running on persistent worker threads."""
+import threading
+from time import perf_counter
+
+from timing import recorder
+
+
+class LatestWinsScheduler:
+    """Runs jobs on persistent worker threads keeping only the newest request per channel.
+
+    Submitting a job to a channel replaces any job of that channel that hasn't started yet, so stale requests
+    are dropped before they start. Every submission gets a generation number, results of jobs that were
+    superseded while running can be recognised with is_current(). Channels with a lower priority value run first.
+
+    handler(job) does the work on a worker thread, its return value is passed to
+    on_result(generation, channel, job, result), exceptions go to on_error(generation, channel, job, exception).
+    Both callbacks are called on the worker thread. Time spent waiting and running is recorded as the spans
+    "<channel> wait" and "<channel> run".
+    """
+
+    def __init__(self, handler, on_result, on_error=None, workers=1):
+        self._handler = handler
+        self._on_result = on_result
+        self._on_error = on_error
+        self._cond = threading.Condition()
+        self._pending = {}  # channel -> (priority, generation, job, submit time)
+        self._latest = {}  # channel -> newest generation submitted
+        self._generation = 0
+        self._running = 0
+        self._closed = False
+        self._threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._work, name=f"conversion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def workers(self):
+        return len(self._threads)
+
+    def submit(self, job, channel="preview", priority=0):
+        with self._cond:
+            self._generation += 1
+            self._pending[channel] = (priority, self._generation, job, perf_counter())
+            self._latest[channel] = self._generation
+            self._cond.notify()
+            return self._generation
+
+    def is_current(self, generation, channel="preview"):
+        return self._latest.get(channel) == generation
+
+    def has_newer(self, channel="preview"):
+        """True if a job of the channel waits, so a long running handler of that channel may stop early."""
+        with self._cond:
+            return channel in self._pending
+
+    @property
+    def busy(self):
+        return self._running > 0 or bool(self._pending)
+
+    def shutdown(self, wait=False):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _next_job(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            channel = min(self._pending, key=lambda c: (self._pending[c][0], self._pending[c][1]))
+            priority, generation, job, submitted = self._pending.pop(channel)
+            self._running += 1
+            recorder.add(f"{channel} wait", submitted, perf_counter())
+            return channel, generation, job
+
+    def _work(self):
+        while True:
+            task = self._next_job()
+            if task is None:
+                return
+            channel, generation, job = task
+            start = perf_counter()
+            try:
+                result = self._handler(job)
+            except Exception as e:
+                if self._on_error:
+                    self._on_error(generation, channel, job, e)
+            else:
+                self._on_result(generation, channel, job, result)
+            finally:
+                recorder.add(f"{channel} run", start, perf_counter())
+                with self._cond:
+                    self._running -= 1
+
+
+class IdleTaskRunner:
+    """Runs low priority tasks one at a time on a background thread, only while is_idle() returns True.
+
+    replace() swaps the whole task list, so a new set of tasks supersedes the old one. A task that already
+    started can't be interrupted, is_idle() is checked again before every task.
+    """
+
+    def __init__(self, handler, is_idle, poll_interval=0.05):
+        self._handler = handler
+        self._is_idle = is_idle
+        self._poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._tasks = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._work, name="idle-worker", daemon=True)
+        self._thread.start()
+
+    def replace(self, tasks):
+        with self._cond:
+            self._tasks = list(tasks)
+            self._cond.notify()
+
+    def clear(self):
+        self.replace([])
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._tasks = []
+            self._cond.notify()
+
+    def _next_task(self):
+        with self._cond:
+            while not self._closed:
+                if self._tasks and self._is_idle():
+                    return self._tasks.pop(0)
+                # Wait for tasks, or poll until the foreground work is done
+                self._cond.wait(self._poll_interval if self._tasks else None)
+            return None
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            try:
+                self._handler(task)
+            except Exception:
+                pass  # Speculative work, a failure only means there's nothing to reuse
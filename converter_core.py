@@ -0,0 +1,305 @@
+"""Qt-free WebP conversion core shared by the GUI and the command line tools."""
+import io
+import logging
+import math
+import os
+import sys
+import threading
+
+from PIL import Image
+# Registering the formats of SUPPORTED_EXTENSIONS up front means opening and saving them never needs Image.init(),
+# which imports all of Pillow's ~40 format plugins. Only a file no registered format recognizes still triggers it.
+from PIL import BmpImagePlugin, GifImagePlugin, JpegImagePlugin, PngImagePlugin, WebPImagePlugin  # noqa: F401
+
+from timing import span
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+# Rows of the output produced per step when oversized images are downscaled
+DOWNSCALE_STRIP_HEIGHT = 256
+
+# Pixel buffer allocations per pipeline stage, counted per thread so a job can report its own
+_copy_counts = threading.local()
+
+
+def count_copy(stage, nbytes):
+    """Record that a stage allocated or copied a buffer of nbytes on this thread."""
+    counts = getattr(_copy_counts, 'counts', None)
+    if counts is None:
+        counts = _copy_counts.counts = {}
+    count, total = counts.get(stage, (0, 0))
+    counts[stage] = count + 1, total + nbytes
+
+
+def pop_copy_counts():
+    """Copies counted on this thread since the last call, {stage: (count, bytes)}."""
+    counts = getattr(_copy_counts, 'counts', None) or {}
+    _copy_counts.counts = {}
+    return counts
+
+
+def format_copy_counts(counts):
+    return ", ".join(f"{stage} {count}x {total / 1024 / 1024:.1f} MB" for stage, (count, total) in counts.items())
+
+
+def image_nbytes(img):
+    """Approximate memory used by the pixel data of a Pillow image."""
+    if len(img.getbands()) > 1 or img.mode in ("I", "F"):
+        return img.width * img.height * 4  # Pillow stores RGB with a padding byte as well
+    return img.width * img.height * (2 if img.mode.startswith("I;16") else 1)
+
+
+def load_image(image_path, max_dimension=None):
+    """Decode an image file into the pixel format the encoder expects, see encoder_mode().
+
+    With max_dimension, larger images are downscaled so their longest side fits. JPEGs are then decoded directly
+    at a reduced scale, other formats are downscaled and converted strip by strip, so the full size image is never
+    held twice, also for palette and CMYK files.
+    """
+    with Image.open(image_path) as src:
+        size = decoded_size(src.size, max_dimension)
+        if size != src.size:
+            _draft(src, size)
+        with span("decode", file=os.path.basename(image_path), format=src.format):
+            src.load()
+        count_copy("decode", image_nbytes(src))
+        if size != src.size:
+            with span("downscale"):
+                src = downscale_in_strips(src, size)
+        with span("mode"):
+            return encoder_mode(src)
+
+
+def encoder_mode(img):
+    """RGB, or RGBA when the image has transparency that isn't fully opaque.
+
+    The image itself is returned when it's in that mode already, so opaque JPEGs and BMPs are never copied and
+    the encoder doesn't process an alpha channel that has no effect.
+    """
+    if img.has_transparency_data:
+        if img.mode != "RGBA":
+            img = _convert(img, "RGBA")
+        alpha = img.getchannel("A")
+        count_copy("alpha check", image_nbytes(alpha))
+        if alpha.getextrema() != (255, 255):
+            return img
+    return img if img.mode == "RGB" else _convert(img, "RGB")
+
+
+def _convert(img, mode):
+    img = img.convert(mode)
+    count_copy("convert", image_nbytes(img))
+    return img
+
+
+def decoded_size(size, max_dimension=None):
+    """Size load_image() produces for an image of the given size."""
+    if not max_dimension or max(size) <= max_dimension:
+        return size
+    ratio = max_dimension / max(size)
+    return max(1, round(size[0] * ratio)), max(1, round(size[1] * ratio))
+
+
+def load_draft(image_path, max_size, reduced_only=False):
+    """Fast reduced resolution decode for display, returns (image, full size of the file).
+
+    The image is at least max_size (width, height) where the format can decode at a reduced scale (JPEG),
+    otherwise it's the full image. With reduced_only the image is None instead when that would mean a full
+    decode of an image larger than max_size.
+    """
+    with Image.open(image_path) as src:
+        full_size = src.size
+        ratio = min(1.0, max_size[0] / src.width, max_size[1] / src.height)
+        reduced = _draft(src, (max(1, int(src.width * ratio)), max(1, int(src.height * ratio))))
+        if reduced_only and reduced is None and ratio < 1.0:
+            return None, full_size
+        with span("draft decode", file=os.path.basename(image_path)):
+            src.load()
+            count_copy("draft decode", image_nbytes(src))
+            return encoder_mode(src), full_size
+
+
+def _draft(src, size):
+    """Let the decoder produce the smallest scale (1/2 .. 1/8 for JPEG) that is still at least size.
+
+    Returns None when the format can't decode at a reduced scale or no reduction was needed.
+    """
+    return src.draft(src.mode if src.mode in ("RGB", "L") else None, size)
+
+
+def downscale_in_strips(src, size, strip_height=DOWNSCALE_STRIP_HEIGHT):
+    """High quality downscale that allocates the output plus one strip instead of a full size intermediate.
+
+    Every strip is resampled from a crop of the source rows it needs, palette, CMYK and transparent images are
+    converted crop by crop as well instead of as a whole.
+    """
+    mode = src.mode
+    if mode not in ("RGB", "RGBA", "L", "LA", "I", "F"):
+        mode = "RGBA" if "A" in src.getbands() or "transparency" in src.info else "RGB"
+    out = Image.new(mode, size)
+    y_ratio = src.height / size[1]
+    # Source rows the filter reads around the box of a strip, Lanczos reaches 3 output rows on either side
+    margin = math.ceil(3 * y_ratio) + 1
+    for top in range(0, size[1], strip_height):
+        bottom = min(size[1], top + strip_height)
+        box_top, box_bottom = top * y_ratio, bottom * y_ratio
+        crop_top = max(0, int(box_top) - margin)
+        rows = src.crop((0, crop_top, src.width, min(src.height, math.ceil(box_bottom) + margin)))
+        if rows.mode != mode:
+            rows = rows.convert(mode)
+        count_copy("downscale rows", image_nbytes(rows))
+        strip = rows.resize((size[0], bottom - top), Image.Resampling.LANCZOS,
+                            box=(0, box_top - crop_top, src.width, box_bottom - crop_top))
+        count_copy("downscale strip", image_nbytes(strip))
+        out.paste(strip, (0, top))
+    count_copy("downscale", image_nbytes(out))
+    return out
+
+
+def reset_peak_rss():
+    """Start measuring peak memory from now, only supported on Linux. Returns True when it was reset."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, since reset_peak_rss() where supported, else since start."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                    'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / 1024 / 1024
+        return 0.0
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB elsewhere
+
+
+def webp_params(quality, method, lossless):
+    """Pillow save parameters for the given settings."""
+    params = {
+        'format': 'WEBP',
+        'quality': quality,
+        'method': method,
+    }
+    if lossless:
+        params['lossless'] = True
+    return params
+
+
+def encode_image(img, quality, method, lossless):
+    """Encode a decoded image to WebP bytes, safe to call from several threads with the same image."""
+    # Image.save() stores the parameters on the image object, so concurrent encodes of a shared image each need
+    # their own Image object. It shares the pixel data, nothing is copied.
+    img = img._new(img.im)
+    buffer = io.BytesIO()
+    with span("encode", size=f"{img.width}x{img.height}", quality=quality, method=method, lossless=lossless):
+        img.save(buffer, **webp_params(quality, method, lossless))
+    data = buffer.getvalue()
+    count_copy("encode", len(data))
+    return data
+
+
+def encode_region(img, box, quality, method, lossless):
+    """Encode only the (left, top, right, bottom) region of an image, used for fast viewport previews."""
+    region = img.crop(box)
+    count_copy("crop", image_nbytes(region))
+    return encode_image(region, quality, method, lossless)
+
+
+def tile_box(tiles, tile_size, image_size):
+    """Bounding box in pixels of a set of (column, row) tiles, clipped to the image."""
+    left = min(col for col, _ in tiles) * tile_size
+    top = min(row for _, row in tiles) * tile_size
+    right = min(image_size[0], (max(col for col, _ in tiles) + 1) * tile_size)
+    bottom = min(image_size[1], (max(row for _, row in tiles) + 1) * tile_size)
+    return left, top, right, bottom
+
+
+def convert_file(image_path, save_path, quality, method, lossless, max_dimension=None):
+    """Convert one file, returns the size of the written WebP file in bytes."""
+    reset_peak_rss()
+    webp_data = encode_image(load_image(image_path, max_dimension), quality, method, lossless)
+    with open(save_path, 'wb') as f:
+        f.write(webp_data)
+    logger.info("%s: peak RSS %.0f MB", image_path, peak_rss_mb())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: copies %s", image_path, format_copy_counts(pop_copy_counts()))
+    return len(webp_data)
+
+
+def is_supported(file_path):
+    return os.path.splitext(file_path)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def collect_images(paths, recursive=True):
+    """Expand files and directories into (image_path, base_dir) pairs.
+
+    base_dir is the directory the image was found under, it's used to mirror the folder structure in the output.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if is_supported(name):
+                            yield os.path.join(root, name), path
+            else:
+                for name in sorted(os.listdir(path)):
+                    file_path = os.path.join(path, name)
+                    if os.path.isfile(file_path) and is_supported(name):
+                        yield file_path, path
+        else:
+            yield path, os.path.dirname(path)
+
+
+def output_path(image_path, base_dir, output_dir=None):
+    """Where the WebP version of image_path goes: next to the source or mirrored under output_dir."""
+    stem = os.path.splitext(image_path)[0]
+    if output_dir is None:
+        return stem + '.webp'
+    relative = os.path.relpath(stem, base_dir) if base_dir else os.path.basename(stem)
+    return os.path.join(output_dir, relative + '.webp')
+
+
+def int_list(text):
+    """argparse type of comma separated integers, e.g. 320,640,960."""
+    return [int(value) for value in text.split(',') if value]
+
+
+def add_encoder_arguments(parser, method_default=6, quality_default=80, quality_type=int,
+                          quality_help="quality 0-100 (default 80)", jobs_help=None):
+    """Add the -q/--quality, -m/--method and --lossless options of the command line tools.
+
+    -j/--jobs is only added when jobs_help says what a job is, e.g. "worker processes".
+    """
+    parser.add_argument('-q', '--quality', type=quality_type, default=quality_default, help=quality_help)
+    parser.add_argument('-m', '--method', type=int, default=method_default, choices=range(7),
+                        help=f"method 0-6 (default {method_default})")
+    parser.add_argument('--lossless', action='store_true', help="lossless compression")
+    if jobs_help:
+        parser.add_argument('-j', '--jobs', type=int, default=None, help=f"{jobs_help} (default: all cores)")
@@ -0,0 +1,272 @@
+import os
+import threading
+from collections import OrderedDict
+
+from animation import animation_to_webp, is_animated
+from converter_core import load_image, encode_image, encode_region, image_nbytes
+
+# Memory cap for decoded source images, can be overridden with IMAGE_CONVERTER_CACHE_MB
+DEFAULT_DECODED_CACHE_MB = 1024
+# Byte budget for encoded WebP results, can be overridden with IMAGE_CONVERTER_ENCODED_CACHE_MB
+DEFAULT_ENCODED_CACHE_MB = 256
+# Longest side of decoded images, larger ones are downscaled while decoding (IMAGE_CONVERTER_MAX_DIMENSION, 0 = off)
+DEFAULT_MAX_DIMENSION = 0
+
+
+def source_key(image_path):
+    """Identity of a file on disk: absolute path plus modification time and size."""
+    stat = os.stat(image_path)
+    return os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size
+
+
+class DecodedImageCache:
+    """LRU cache of decoded source images limited by the total size of their pixel data.
+
+    Cached images are shared between the GUI thread and conversion threads, so callers must treat
+    them as read-only. A file requested by several threads at once is decoded only once.
+    """
+
+    def __init__(self, max_bytes, max_dimension=None):
+        self.max_bytes = max_bytes
+        self.max_dimension = max_dimension
+        self._items = OrderedDict()
+        self._used_bytes = 0
+        self._lock = threading.Lock()
+        self._decoding = {}  # key -> lock held by the thread decoding it
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_path):
+        key = source_key(image_path)
+        while True:
+            with self._lock:
+                img = self._items.get(key)
+                if img is not None:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return img
+                decoding = self._decoding.get(key)
+                if decoding is None:
+                    self.misses += 1
+                    decoding = self._decoding[key] = threading.Lock()
+                    decoding.acquire()
+                    break
+            # Another thread is decoding this file, wait for it instead of holding a second copy
+            with decoding:
+                pass
+            if key not in self._items:
+                # It failed or the image didn't fit the cache, decode it here
+                with self._lock:
+                    self.misses += 1
+                return load_image(image_path, self.max_dimension)
+
+        # Decode outside the lock so the GUI thread is not blocked by a conversion thread
+        try:
+            img = load_image(image_path, self.max_dimension)
+            self._put(key, img)
+            return img
+        finally:
+            with self._lock:
+                del self._decoding[key]
+            decoding.release()
+
+    def _put(self, key, img):
+        size = image_nbytes(img)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._used_bytes -= image_nbytes(old)
+            # Drop stale entries of the same file (it was modified on disk)
+            for stale in [k for k in self._items if k[0] == key[0]]:
+                self._used_bytes -= image_nbytes(self._items.pop(stale))
+            if size > self.max_bytes:
+                return  # Larger than the whole cache, don't keep it
+            self._items[key] = img
+            self._used_bytes += size
+            while self._used_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._used_bytes -= image_nbytes(evicted)
+
+    def peek(self, image_path):
+        """The cached image or None, never decodes."""
+        key = source_key(image_path)
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            return img
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._used_bytes = 0
+
+    @property
+    def used_bytes(self):
+        return self._used_bytes
+
+    def __len__(self):
+        return len(self._items)
+
+
+decoded_cache = DecodedImageCache(
+    int(os.environ.get("IMAGE_CONVERTER_CACHE_MB", DEFAULT_DECODED_CACHE_MB)) * 1024 * 1024,
+    int(os.environ.get("IMAGE_CONVERTER_MAX_DIMENSION", DEFAULT_MAX_DIMENSION)) or None)
+
+
+def encoded_key(image_path, quality, method, lossless):
+    """Key of an encoded result: source identity plus every parameter that affects the output bytes."""
+    return source_key(image_path), quality, method, lossless
+
+
+class EncodedCache:
+    """LRU cache of encoded WebP bytes limited by their total size.
+
+    Entries stored with speculative=True were encoded before anyone asked for them, speculative_hits counts how
+    many of them were used later. Quality metrics of an entry are kept with it and dropped together with it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._used_bytes = 0
+        self._lock = threading.Lock()
+        self._speculative = set()
+        self._metrics = {}  # key -> {full_resolution: QualityMetrics}
+        self.hits = 0
+        self.misses = 0
+        self.speculative_puts = 0
+        self.speculative_hits = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            if key in self._speculative:
+                self._speculative.discard(key)
+                self.speculative_hits += 1
+            return data
+
+    def put(self, key, data, speculative=False):
+        size = len(data)
+        with self._lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._items[key] = data
+            self._used_bytes += size
+            if speculative:
+                self._speculative.add(key)
+                self.speculative_puts += 1
+            self._evict()
+
+    def get_metrics(self, key, full_resolution):
+        with self._lock:
+            return self._metrics.get(key, {}).get(full_resolution)
+
+    def put_metrics(self, key, full_resolution, metrics):
+        """Store the quality metrics of a cached entry, ignored when the entry isn't cached (anymore)."""
+        with self._lock:
+            if key not in self._items:
+                return
+            old = self._metrics.setdefault(key, {}).pop(full_resolution, None)
+            if old is not None:
+                self._used_bytes -= _metrics_nbytes(old)
+            self._metrics[key][full_resolution] = metrics
+            self._used_bytes += _metrics_nbytes(metrics)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._speculative.clear()
+            self._metrics.clear()
+            self._used_bytes = 0
+
+    def _drop(self, key):
+        data = self._items.pop(key, None)
+        if data is not None:
+            self._used_bytes -= len(data)
+        for metrics in self._metrics.pop(key, {}).values():
+            self._used_bytes -= _metrics_nbytes(metrics)
+        self._speculative.discard(key)
+
+    def _evict(self):
+        while self._used_bytes > self.max_bytes and self._items:
+            self._drop(next(iter(self._items)))
+
+    @property
+    def used_bytes(self):
+        return self._used_bytes
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _metrics_nbytes(metrics):
+    return 64 + (metrics.error_map.nbytes if metrics.error_map is not None else 0)
+
+
+encoded_cache = EncodedCache(
+    int(os.environ.get("IMAGE_CONVERTER_ENCODED_CACHE_MB", DEFAULT_ENCODED_CACHE_MB)) * 1024 * 1024)
+
+
+def encode_to_webp(image_path, quality, method, lossless, progress=None):
+    """Encode image to WebP bytes through both caches.
+
+    Preview and save share this function so they always produce the same bytes. Animated sources are streamed
+    frame by frame into an animated WebP instead, progress is passed on to encode_animation().
+    """
+    key = encoded_key(image_path, quality, method, lossless)
+    webp_data = encoded_cache.get(key)
+    if webp_data is None:
+        if is_animated(image_path):
+            webp_data = animation_to_webp(image_path, quality, method, lossless, progress)
+        else:
+            webp_data = encode_image(decoded_cache.get(image_path), quality, method, lossless)
+        encoded_cache.put(key, webp_data)
+    return webp_data
+
+
+def pre_encode(image_path, quality, method, lossless, max_cache_bytes):
+    """Encode into the cache ahead of time, skipped when cached already or the cache is over max_cache_bytes.
+
+    Returns True when an encode was done.
+    """
+    key = encoded_key(image_path, quality, method, lossless)
+    if key in encoded_cache or encoded_cache.used_bytes >= max_cache_bytes:
+        return False
+    webp_data = encode_image(decoded_cache.get(image_path), quality, method, lossless)
+    encoded_cache.put(key, webp_data, speculative=True)
+    return True
+
+
+def webp_metrics(image_path, quality, method, lossless, full_resolution=False):
+    """PSNR and SSIM of the cached encode, computed once per encode.
+
+    Interactive metrics compare copies reduced to INTERACTIVE_MAX_DIMENSION and include an error map, full
+    resolution ones compare every pixel.
+    """
+    from quality_metrics import INTERACTIVE_MAX_DIMENSION, webp_quality  # NumPy is only loaded once it's needed
+
+    key = encoded_key(image_path, quality, method, lossless)
+    metrics = encoded_cache.get_metrics(key, full_resolution)
+    if metrics is None:
+        webp_data = encode_to_webp(image_path, quality, method, lossless)
+        metrics = webp_quality(decoded_cache.get(image_path), webp_data,
+                               None if full_resolution else INTERACTIVE_MAX_DIMENSION, error_map=not full_resolution)
+        encoded_cache.put_metrics(key, full_resolution, metrics)
+    return metrics
+
+
+def encode_region_to_webp(image_path, box, quality, method, lossless):
+    """Encode a region of the cached source image, results are not cached as they are only shown once."""
+    return encode_region(decoded_cache.get(image_path), box, quality, method, lossless)
@@ -1,23 +1,70 @@
 import sys
 import os
-import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from time import perf_counter
 
-from PIL import Image
+# Reported by --startup-profile
+_IMPORTS_STARTED = perf_counter()
 
 from PyQt6.QtWidgets import (QApplication, QWidget, QLabel, QPushButton, QVBoxLayout, QFileDialog, QSlider, QHBoxLayout,
-                             QGridLayout, QCheckBox, QComboBox, QDialogButtonBox, QTextBrowser, QDialog)
-from PyQt6.QtGui import QPixmap, QMouseEvent
-from PyQt6.QtCore import Qt, QPoint, QTimer, QThread, pyqtSignal, QObject
+                             QGridLayout, QCheckBox, QComboBox, QDialogButtonBox, QTextBrowser, QDialog, QSpinBox,
+                             QListWidget, QListWidgetItem, QListView, QProgressBar, QMessageBox)
+from PyQt6.QtGui import QImage, QMouseEvent, QPixmap
+from PyQt6.QtCore import Qt, QPoint, QSize, QTimer, pyqtSignal, QObject
 from PyQt6.QtWidgets import QScrollArea
 from PyQt6.QtGui import QIcon, QFont
 
-from about import about_text
+from animation import Cancelled, is_animated
+from image_cache import (decoded_cache, encoded_cache, encoded_key, encode_to_webp, encode_region_to_webp, pre_encode,
+                         source_key, webp_metrics)
+from converter_core import (collect_images, count_copy, decoded_size, encode_image, format_copy_counts, is_supported,
+                            load_draft, peak_rss_mb, pop_copy_counts, reset_peak_rss, tile_box)
+from target_size import find_quality_for_size
+from thumbnail_cache import thumbnail_cache
+from tiled_view import TiledImageView
+from conversion_scheduler import IdleTaskRunner, LatestWinsScheduler
+from timing import recorder, span
+
+_IMPORTS_FINISHED = perf_counter()
 
 SCALE_FACTORS = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 150, 200, 250, 300, 350, 400, 450, 500, 550, 600]
 
 APP_CAPTION = "JPG/PNG/BMP to WEBP Converter"
 
+logger = logging.getLogger(__name__)
+
+# Number of preview encodes that may run in parallel, 2-3 shows the newest settings sooner on multi-core machines
+PREVIEW_WORKERS = max(1, int(os.environ.get("IMAGE_CONVERTER_PREVIEW_WORKERS", 1)))
+
+# Progressive preview: the visible region is encoded in tiles of this size (source pixels, multiple of the
+# 16 px WebP macroblock) before the full frame, with a margin around the viewport (screen pixels)
+PREVIEW_TILE_SIZE = 256
+PREVIEW_MARGIN = 64
+
+# Fast WebP method used for previews while the quality slider is dragged
+DRAFT_METHOD = 0
+
+# Speculative pre-encoding of nearby qualities while idle: offsets from the current quality in the order they are
+# encoded, largest image it's done for (an encode that started can't be interrupted) and share of the encoded
+# cache it may fill
+SPECULATIVE_OFFSETS = (5, -5, 10, -10)
+SPECULATIVE_MAX_MEGAPIXELS = 16
+SPECULATIVE_CACHE_SHARE = 0.5
+
+# Target size mode: lowest quality tried before downscaling, probe encodes run in parallel
+TARGET_MIN_QUALITY = 10
+TARGET_PARALLEL_PROBES = 3
+
+# Session strip: threads making thumbnails and the size they're shown at. Save All encodes on all cores
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_ICON_SIZE = 96
+SAVE_ALL_WORKERS = os.cpu_count() or 1
+
+# Imported when the feature is first used, --startup-profile warns when one of them is loaded before the window shows
+LAZY_MODULES = ('about', 'batch_convert', 'numpy', 'quality_metrics', 'responsive_variants', 'size_estimator')
+
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -30,10 +77,47 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
-class DraggableLabel(QLabel):
+def print_startup_profile(app_created, window_created):
+    """ Time from the first import to the shown window by phase, and modules that should have been loaded later """
+    shown = perf_counter()
+    early = [name for name in LAZY_MODULES if name in sys.modules]
+    print(f"Startup: imports {(_IMPORTS_FINISHED - _IMPORTS_STARTED) * 1000:.0f} ms, "
+          f"QApplication {(app_created - _IMPORTS_FINISHED) * 1000:.0f} ms, "
+          f"window built {(window_created - app_created) * 1000:.0f} ms, "
+          f"first window shown {(shown - _IMPORTS_STARTED) * 1000:.0f} ms after the first import")
+    print(f"Modules loaded: {len(sys.modules)}, lazy modules loaded early: {', '.join(early) or 'none'}")
+
+
+def pil_to_qimage(img):
+    """ Convert an RGB or RGBA Pillow image to QImage without touching the file on disk
+
+    The pixels are copied once into a bytes buffer that the QImage shares, the QImage keeps it alive. Qt copies the
+    data before it's painted on, so the buffer is never written to.
+    """
+    if img.mode == "RGBA":
+        data = img.tobytes("raw", "RGBA")
+        image_format = QImage.Format.Format_RGBA8888
+    else:
+        # Same layout as Pillow stores RGB in, 4 bytes per pixel keep Qt on its fast paint path
+        data = img.tobytes("raw", "RGBX")
+        image_format = QImage.Format.Format_RGBX8888
+    with span("to qimage"):
+        count_copy("to qimage", len(data))
+        return QImage(data, img.width, img.height, img.width * 4, image_format)
+
+
+def webp_to_qimage(data):
+    """ Decode WebP data for display, safe to call on worker threads """
+    image = QImage()
+    with span("preview decode"):
+        image.loadFromData(data, "WEBP")
+    count_copy("preview decode", image.sizeInBytes())
+    return image
+
+
+class DraggableLabel(TiledImageView):
     def __init__(self, scroll_area, sync_scroll_area):
         super().__init__()
-        self.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
         self.setCursor(Qt.CursorShape.OpenHandCursor)
         self._dragging = False
         self._startPos = QPoint()
@@ -71,41 +155,303 @@ class DraggableLabel(QLabel):
 
 
 class ImageConversionWorker(QObject):
-    finished = pyqtSignal(bytes, float)
-    started = pyqtSignal()
-    error = pyqtSignal(str)
-
-    def __init__(self, image_path, quality, method, lossless):
+    """ Persistent conversion worker, only the newest request is encoded, stale ones are dropped before they start """
+    # WebP results are decoded on the worker thread, the GUI thread only paints the QImage
+    finished = pyqtSignal(int, bytes, float, object)  # generation, webp data, size in KB, decoded QImage
+    # job, frame index, frame count, estimated size in bytes, QImage of the first frame (None for later frames)
+    animation_progress = pyqtSignal(object, int, int, int, object)
+    draft_finished = pyqtSignal(int, object, object)  # generation, job, QImage of the DRAFT_METHOD encode
+    region_finished = pyqtSignal(int, object, object)  # generation, job, QImage of the region
+    estimate_finished = pyqtSignal(object, object)  # job, SizeEstimate
+    target_finished = pyqtSignal(int, object, object)  # generation, TargetSizeResult, decoded QImage
+    metrics_finished = pyqtSignal(object, object, object)  # job, QualityMetrics, heatmap QImage or None
+    export_finished = pyqtSignal(object, str)  # VariantsResult or None, error message
+    source_loaded = pyqtSignal(str, object)  # image path, full size QImage
+    save_progress = pyqtSignal(str, int, str)  # image path, output size in bytes, error message of Save All
+    error = pyqtSignal(int, str)
+
+    def __init__(self, workers=1, background=()):
         super().__init__()
-        self.image_path = image_path
-        self.quality = quality
-        self.method = method  # Not used with Pillow, can be removed or repurposed
-        self.lossless = lossless
+        self.scheduler = LatestWinsScheduler(self._convert, self._on_result, self._on_error, workers)
+        # Small jobs (visible region, size estimate) get their own thread so they're never stuck behind a running
+        # full frame encode, their errors are reported by the full frame encode of the same image
+        self.fast_scheduler = LatestWinsScheduler(self._convert_fast, self._on_fast_result)
+        # Drafts shown while the slider moves don't wait for a running final encode
+        self.draft_scheduler = LatestWinsScheduler(self._convert_draft, self._on_draft_result)
+        # Exports of several widths run next to the previews
+        self.export_scheduler = LatestWinsScheduler(self._export, self._on_export_result, self._on_export_error)
+        # Neighbouring qualities are pre-encoded one at a time while nothing else runs, background has other work of
+        # the window with a busy property (thumbnails)
+        self._background = background
+        self.speculator = IdleTaskRunner(self._pre_encode, self._is_idle)
+        # Probe sizes of the target size search, reused while the same image and method are searched
+        self._target_sizes_key = None
+        self._target_sizes = {}
+        # Save All, every file is saved, nothing is dropped
+        self.save_pool = ThreadPoolExecutor(max_workers=SAVE_ALL_WORKERS, thread_name_prefix="save-all")
+        self._saves_left = 0  # Files of Save All queued or being saved
+        self._saves_lock = threading.Lock()
+
+    def request(self, image_path, quality, method, lossless):
+        """ Queue a conversion, returns its generation ID """
+        return self.scheduler.submit(("convert", (image_path, quality, method, lossless)))
+
+    def request_load(self, image_path):
+        """ Queue the full decode of the source image, it runs before conversions waiting at the same time """
+        return self.scheduler.submit(("load", (image_path,)), channel="load", priority=-1)
+
+    def request_draft(self, image_path, quality, lossless):
+        """ Queue a fast preview with DRAFT_METHOD, the final conversion replaces it """
+        return self.draft_scheduler.submit((image_path, quality, DRAFT_METHOD, lossless), "draft")
+
+    def request_target(self, image_path, target_bytes, method):
+        """ Queue a search for the highest quality that fits target_bytes, it replaces a queued conversion """
+        return self.scheduler.submit(("target", (image_path, target_bytes, method)))
+
+    def request_region(self, image_path, box, quality, method, lossless):
+        """ Queue encoding of the visible region, a newer region request replaces a queued one """
+        return self.fast_scheduler.submit(("region", (image_path, box, quality, method, lossless)), "region")
+
+    def request_estimate(self, image_path, quality, method, lossless):
+        """ Queue a size estimate from sample tiles, it runs before regions as it's the number the user waits for """
+        return self.fast_scheduler.submit(("estimate", (image_path, quality, method, lossless)), "estimate",
+                                          priority=-1)
+
+    def request_metrics(self, image_path, quality, method, lossless, webp_data=None, full_resolution=False):
+        """ Queue PSNR/SSIM of an encode after everything the preview waits for
+
+        webp_data is only passed for results that aren't in the encoded cache (downscaled target size results).
+        Full resolution requests have their own channel, so a preview can't replace them.
+        """
+        channel = "full metrics" if full_resolution else "metrics"
+        return self.fast_scheduler.submit(
+            ("metrics", (image_path, quality, method, lossless, webp_data, full_resolution)), channel, priority=1)
+
+    def request_export(self, image_path, output_dir, quality, method, lossless):
+        """ Queue encoding the responsive widths of the cached source image into output_dir """
+        return self.export_scheduler.submit((image_path, output_dir, quality, method, lossless), "export")
+
+    def save_all(self, jobs, quality, method, lossless, target_kb=None):
+        """ Convert every (image path, save path) on the save pool, save_progress is emitted for each file """
+        for image_path, save_path in jobs:
+            with self._saves_lock:
+                self._saves_left += 1
+            future = self.save_pool.submit(self._save, image_path, save_path, quality, method, lossless, target_kb)
+            future.add_done_callback(self._on_save_done)
+
+    def _on_save_done(self, future):
+        """ Also called for saves cancelled at shutdown """
+        with self._saves_lock:
+            self._saves_left -= 1
+
+    def _save(self, image_path, save_path, quality, method, lossless, target_kb):
+        """ Save one file of Save All, save_progress is emitted whatever happens so the button is enabled again """
+        # Imported here, it loads NumPy for its metrics
+        from batch_convert import _convert_job
 
-    def run(self):
-        self.started.emit()
         try:
-            # Read image using Pillow
-            img = Image.open(self.image_path).convert("RGBA")
-
-            # Prepare WebP parameters
-            webp_params = {
-                'format': 'WEBP',
-                'quality': self.quality,
-            }
-            if self.lossless:
-                webp_params['lossless'] = True
-
-            # Convert to bytes using Pillow
-            buffer = io.BytesIO()
-            img.save(buffer, **webp_params)
-
-            webp_data = buffer.getvalue()
+            webp_data = None if target_kb else encoded_cache.get(encoded_key(image_path, quality, method, lossless))
+            if webp_data is not None:
+                # Previewed with these settings, the same bytes are saved
+                os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
+                with open(save_path, 'wb') as f:
+                    f.write(webp_data)
+                self.save_progress.emit(image_path, len(webp_data), "")
+                return
+            result = _convert_job(image_path, save_path, quality, method, lossless, target_kb,
+                                  decoded_cache.max_dimension)
+        except Exception as e:
+            # e.g. the file was deleted or renamed after the session was opened
+            self.save_progress.emit(image_path, 0, str(e))
+            return
+        self.save_progress.emit(image_path, result[3], result[5] or "")
+
+    def speculate(self, image_path, qualities, method, lossless):
+        """ Pre-encode the given qualities into the cache at low priority, replaces earlier speculation """
+        self.speculator.replace((image_path, quality, method, lossless) for quality in qualities)
+
+    def stop_speculation(self):
+        self.speculator.clear()
+
+    def is_current(self, generation):
+        return self.scheduler.is_current(generation)
+
+    def is_current_draft(self, generation):
+        return self.draft_scheduler.is_current(generation, "draft")
+
+    def shutdown(self):
+        self.scheduler.shutdown()
+        self.fast_scheduler.shutdown()
+        self.draft_scheduler.shutdown()
+        self.export_scheduler.shutdown()
+        self.speculator.shutdown()
+        self.save_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _is_idle(self):
+        """ Speculation waits for previews, exports, Save All and the background work of the window """
+        return not (self.scheduler.busy or self.fast_scheduler.busy or self.draft_scheduler.busy
+                    or self.export_scheduler.busy or self._saves_left or any(work.busy for work in self._background))
+
+    @staticmethod
+    def _pre_encode(job):
+        return pre_encode(*job, max_cache_bytes=encoded_cache.max_bytes * SPECULATIVE_CACHE_SHARE)
+
+    @staticmethod
+    def _export(job):
+        image_path, output_dir, quality, method, lossless = job
+        from responsive_variants import export_variants
+
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        return export_variants(decoded_cache.get(image_path), name, output_dir, qualities=(quality,), method=method,
+                               lossless=lossless)
+
+    def _on_export_result(self, generation, channel, job, result):
+        self.export_finished.emit(result, "")
+
+    def _on_export_error(self, generation, channel, job, exception):
+        self.export_finished.emit(None, f"Error exporting sizes: {str(exception)}")
+
+    @staticmethod
+    def _convert_draft(job):
+        pop_copy_counts()
+        return encode_to_webp(*job)
+
+    @staticmethod
+    def _log_copies(kind, image_path):
+        """ Buffers the job allocated on this thread, from decode to the QImage shown """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s %s: copies %s", kind, image_path, format_copy_counts(pop_copy_counts()) or "none")
+
+    def _convert(self, job):
+        kind, args = job
+        pop_copy_counts()
+        if kind == "load":
+            return pil_to_qimage(decoded_cache.get(*args))
+        if kind == "target":
+            return self._find_target_quality(*args)
+
+        reset_peak_rss()
+        webp_data = encode_to_webp(*args, progress=lambda *frame: self._on_frame(args, *frame))
+        logger.info("%s: conversion peak RSS %.0f MB", args[0], peak_rss_mb())
+        return webp_data
+
+    def _on_frame(self, job, index, count, written, estimate, frame_webp):
+        """ Progress of an animated conversion, returns False to stop it when a newer conversion waits """
+        self.animation_progress.emit(job, index, count, estimate, webp_to_qimage(frame_webp) if index == 0 else None)
+        return not self.scheduler.has_newer()
+
+    def _find_target_quality(self, image_path, target_bytes, method):
+        key = (source_key(image_path), method)
+        if key != self._target_sizes_key:
+            self._target_sizes_key, self._target_sizes = key, {}
+
+        def encode(image, quality, scale):
+            # Full size probes go through the cache, so they are shared with the normal preview
+            if scale == 1.0:
+                return encode_to_webp(image_path, quality, method, False)
+            return encode_image(image, quality, method, False)
+
+        return find_quality_for_size(decoded_cache.get(image_path), target_bytes, method, encode=encode,
+                                     sizes=self._target_sizes, min_quality=TARGET_MIN_QUALITY,
+                                     parallel=TARGET_PARALLEL_PROBES)
+
+    @staticmethod
+    def _convert_fast(job):
+        kind, args = job
+        pop_copy_counts()
+        if kind == "estimate":
+            from size_estimator import estimate_webp_size
+
+            image_path, quality, method, lossless = args
+            return estimate_webp_size(decoded_cache.get(image_path), quality, method, lossless)
+        if kind == "metrics":
+            from quality_metrics import INTERACTIVE_MAX_DIMENSION, heatmap, webp_quality
+
+            image_path, quality, method, lossless, webp_data, full_resolution = args
+            if webp_data is None:
+                metrics = webp_metrics(image_path, quality, method, lossless, full_resolution)
+            else:
+                metrics = webp_quality(decoded_cache.get(image_path), webp_data,
+                                       None if full_resolution else INTERACTIVE_MAX_DIMENSION,
+                                       error_map=not full_resolution)
+            overlay = pil_to_qimage(heatmap(metrics.error_map)) if metrics.error_map is not None else None
+            return metrics, overlay
+        return encode_region_to_webp(*args)
+
+    # Called on the worker thread, Qt delivers the signals to the GUI thread
+    def _on_fast_result(self, generation, channel, job, result):
+        kind, args = job
+        if kind == "estimate":
+            self.estimate_finished.emit(args, result)
+        elif kind == "metrics":
+            self.metrics_finished.emit(args, *result)
+        else:
+            self.region_finished.emit(generation, args, webp_to_qimage(result))
+        self._log_copies(kind, args[0])
+
+    def _on_draft_result(self, generation, channel, job, webp_data):
+        self.draft_finished.emit(generation, job, webp_to_qimage(webp_data))
+        self._log_copies("draft", job[0])
+
+    def _on_result(self, generation, channel, job, result):
+        kind, args = job
+        if kind == "load":
+            self.source_loaded.emit(args[0], result)
+        elif kind == "target":
+            self.target_finished.emit(generation, result, webp_to_qimage(result.data))
+        else:
+            webp_data = result
             estimated_size = len(webp_data) / 1024  # in KB
-            self.finished.emit(webp_data, estimated_size)
+            self.finished.emit(generation, webp_data, estimated_size, webp_to_qimage(webp_data))
+        self._log_copies(kind, args[0])
+
+    def _on_error(self, generation, channel, job, exception):
+        if channel == "load" or isinstance(exception, Cancelled):
+            return  # The conversion of the same image fails too and reports it, or a newer one replaced it
+        self.error.emit(generation, f"Error converting image: {str(exception)}")
+
+
+class ThumbnailLoader(QObject):
+    """ Thumbnails of the session strip, made on a thread pool at reduced resolution and kept on disk """
+    thumbnail_ready = pyqtSignal(int, str, object)  # session, image path, QImage
 
+    def __init__(self, workers=THUMBNAIL_WORKERS):
+        super().__init__()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._session = 0
+        self._left = 0  # Thumbnails queued or being made, of any session
+        self._lock = threading.Lock()
+
+    def request(self, image_paths):
+        """ Start the thumbnails of a new session, returns its ID. Queued ones of the previous session are skipped """
+        self._session += 1
+        for image_path in image_paths:
+            with self._lock:
+                self._left += 1
+            self._pool.submit(self._load, self._session, image_path).add_done_callback(self._on_done)
+        return self._session
+
+    @property
+    def busy(self):
+        return self._left > 0
+
+    def _on_done(self, future):
+        with self._lock:
+            self._left -= 1
+
+    def _load(self, session, image_path):
+        if session != self._session:
+            return
+        try:
+            data = thumbnail_cache.thumbnail(image_path)
         except Exception as e:
-            self.error.emit(f"Error converting image: {str(e)}")
+            logger.warning("Thumbnail of %s failed: %s", image_path, e)
+            return
+        self.thumbnail_ready.emit(session, image_path, webp_to_qimage(data))
+
+    def shutdown(self):
+        self._session += 1
+        self._pool.shutdown(wait=False, cancel_futures=True)
 
 
 class ImageConverter(QWidget):
@@ -113,11 +459,46 @@ class ImageConverter(QWidget):
         super().__init__()
         self.initUI()
         self.image_path = None
+        self._animated = False
+        self._source_image = None
+        self._source_size = (0, 0)  # Size of the decoded image, known before the full decode finishes
+        self._converted_is_placeholder = False
         self.scale_index = SCALE_FACTORS.index(100)
         self.setAcceptDrops(True)
         self.center_on_screen()
-        self._conversion_thread = None
-        self._conversion_worker = None
+        self._thumbnail_loader = ThumbnailLoader()
+        self._thumbnail_loader.thumbnail_ready.connect(self.on_thumbnail_ready)
+        self._conversion_worker = ImageConversionWorker(PREVIEW_WORKERS, background=(self._thumbnail_loader,))
+        self._conversion_worker.finished.connect(self.on_conversion_finished)
+        self._conversion_worker.animation_progress.connect(self.on_animation_progress)
+        self._conversion_worker.draft_finished.connect(self.on_draft_finished)
+        self._conversion_worker.region_finished.connect(self.on_region_finished)
+        self._conversion_worker.estimate_finished.connect(self.on_estimate_finished)
+        self._conversion_worker.target_finished.connect(self.on_target_finished)
+        self._conversion_worker.metrics_finished.connect(self.on_metrics_finished)
+        self._conversion_worker.export_finished.connect(self.on_export_finished)
+        self._conversion_worker.source_loaded.connect(self.on_source_loaded)
+        self._conversion_worker.save_progress.connect(self.on_save_progress)
+        # Images opened together, as (image path, directory it was found under), the strip shows their thumbnails
+        self.session = []
+        self._thumbnail_items = {}
+        self._thumbnail_session = 0
+        self._save_all_state = None  # (files left, saved bytes, failed files, start time) while Save All runs
+        self._target_result = None
+        self._draft_shown = False
+        self._metrics_job = None  # Interactive metrics request of the conversion shown
+        self._heatmap = None
+        self._conversion_worker.error.connect(self.on_conversion_error)
+        self._conversion_start_time = 0.0
+
+        # Progressive preview state: tiles of the current settings already painted, settings of the full frame shown
+        self._preview_tiles = set()
+        self._full_preview_params = None
+        self._pan_timer = QTimer(self)
+        self._pan_timer.setSingleShot(True)
+        self._pan_timer.timeout.connect(self.request_visible_tiles)
+        self.converted_scroll.horizontalScrollBar().valueChanged.connect(lambda: self._pan_timer.start(30))
+        self.converted_scroll.verticalScrollBar().valueChanged.connect(lambda: self._pan_timer.start(30))
 
         self._debounce_timer = QTimer(self)
         self._debounce_timer.setSingleShot(True)
@@ -146,6 +527,17 @@ class ImageConverter(QWidget):
         self.save_button.setFixedHeight(45)
         self.save_button.setFont(button_font)
         self.save_button.clicked.connect(self.save_image)
+        self.export_button = QPushButton("📐Export Sizes")
+        self.export_button.setFixedHeight(45)
+        self.export_button.setFont(button_font)
+        self.export_button.setToolTip("Save several widths for a responsive srcset into a folder")
+        self.export_button.clicked.connect(self.export_sizes)
+        self.save_all_button = QPushButton("💾Save All")
+        self.save_all_button.setFixedHeight(45)
+        self.save_all_button.setFont(button_font)
+        self.save_all_button.setToolTip("Convert every opened image with the current settings into a folder")
+        self.save_all_button.setEnabled(False)
+        self.save_all_button.clicked.connect(self.save_all)
 
         self.image_layout = QGridLayout()
         self.original_scroll = QScrollArea()
@@ -161,12 +553,13 @@ class ImageConverter(QWidget):
         self.converted_scroll.setWidgetResizable(True)
         self.image_layout.addWidget(self.converted_scroll, 1, 2)  # Row 1
 
-        self.fps_overlay_label = QLabel("0 fps", self.converted_scroll)
-        self.fps_overlay_label.setStyleSheet(
+        # Latency of the last preview with rolling percentiles, the tooltip breaks it down by stage
+        self.timing_overlay_label = QLabel("-", self.converted_scroll)
+        self.timing_overlay_label.setStyleSheet(
             "QLabel { background-color: rgba(0, 0, 0, 128); color: white; padding: 2px; }")
-        self.fps_overlay_label.move(5, 5)
-        self.fps_overlay_label.raise_()
-        self.fps_overlay_label.show()
+        self.timing_overlay_label.move(5, 5)
+        self.timing_overlay_label.raise_()
+        self.timing_overlay_label.show()
 
         self.zoom_layout = QVBoxLayout()
         self.zoom_layout.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -209,6 +602,10 @@ class ImageConverter(QWidget):
         self.converted_size_label = QLabel("Converted Size: -")
         self.image_layout.addWidget(self.converted_size_label, 2, 2)
 
+        # PSNR/SSIM of the converted image against the original
+        self.quality_label = QLabel("PSNR: -")
+        self.image_layout.addWidget(self.quality_label, 3, 2)
+
         # === Create a horizontal layout for Method and Lossless widgets (aligned right) ===
         options_layout = QHBoxLayout()
         options_layout.addStretch()  # Push widgets to the right
@@ -231,12 +628,40 @@ class ImageConverter(QWidget):
         self.lossless_checkbox.stateChanged.connect(self.update_preview)
         options_layout.addWidget(self.lossless_checkbox)
 
+        options_layout.addSpacing(10)
+
+        # Progressive checkbox, visible region is shown first and the full frame replaces it
+        self.progressive_checkbox = QCheckBox("Progressive")
+        self.progressive_checkbox.setChecked(True)
+        self.progressive_checkbox.setToolTip("Encode the visible region first, then the full image")
+        options_layout.addWidget(self.progressive_checkbox)
+
+        options_layout.addSpacing(10)
+
+        # Heatmap of the difference to the original over the converted image
+        self.heatmap_checkbox = QCheckBox("Heatmap")
+        self.heatmap_checkbox.setToolTip("Highlight where the converted image differs from the original")
+        self.heatmap_checkbox.toggled.connect(self.update_heatmap)
+        options_layout.addWidget(self.heatmap_checkbox)
+
         # Add the options layout BELOW the converted image, aligned right (row 2, column 2)
         self.image_layout.addLayout(options_layout, 2, 2)
 
         # Add the image layout to the main layout
         layout.addLayout(self.image_layout)
 
+        # Thumbnails of the images opened together, shown when there is more than one
+        self.thumbnail_strip = QListWidget()
+        self.thumbnail_strip.setViewMode(QListView.ViewMode.IconMode)
+        self.thumbnail_strip.setFlow(QListView.Flow.LeftToRight)
+        self.thumbnail_strip.setWrapping(False)
+        self.thumbnail_strip.setMovement(QListView.Movement.Static)
+        self.thumbnail_strip.setIconSize(QSize(THUMBNAIL_ICON_SIZE, THUMBNAIL_ICON_SIZE))
+        self.thumbnail_strip.setFixedHeight(THUMBNAIL_ICON_SIZE + 45)
+        self.thumbnail_strip.currentRowChanged.connect(self.on_thumbnail_selected)
+        self.thumbnail_strip.hide()
+        layout.addWidget(self.thumbnail_strip)
+
         # Create and add slider layout
         slider_layout = QHBoxLayout()
         self.quality_slider = QSlider(Qt.Orientation.Horizontal)
@@ -249,12 +674,34 @@ class ImageConverter(QWidget):
 
         self.compression_label = QLabel("80%")
         slider_layout.addWidget(self.compression_label)
+
+        # Target size mode, the quality is searched instead of set with the slider
+        slider_layout.addSpacing(10)
+        self.target_checkbox = QCheckBox("Target size:")
+        self.target_checkbox.setToolTip("Find the highest quality that fits the size")
+        self.target_checkbox.toggled.connect(self.on_target_mode_changed)
+        slider_layout.addWidget(self.target_checkbox)
+        self.target_spinbox = QSpinBox()
+        self.target_spinbox.setRange(1, 100000)
+        self.target_spinbox.setValue(200)
+        self.target_spinbox.setSuffix(" KB")
+        self.target_spinbox.setEnabled(False)
+        self.target_spinbox.valueChanged.connect(self.update_preview)
+        slider_layout.addWidget(self.target_spinbox)
         layout.addLayout(slider_layout)
 
         # Create a horizontal layout for the buttons
         buttons_layout = QHBoxLayout()
         buttons_layout.addWidget(self.load_button)
         buttons_layout.addWidget(self.save_button)
+        buttons_layout.addWidget(self.save_all_button)
+        buttons_layout.addWidget(self.export_button)
+
+        # Progress of Save All
+        self.save_all_progress = QProgressBar()
+        self.save_all_progress.setFixedHeight(45)
+        self.save_all_progress.hide()
+        buttons_layout.addWidget(self.save_all_progress)
 
         # Add the horizontal button layout to the main layout
         layout.addLayout(buttons_layout)
@@ -271,6 +718,8 @@ class ImageConverter(QWidget):
 
         help_text = QTextBrowser()
         help_text.setOpenExternalLinks(True)
+        from about import about_text
+
         help_text.setHtml(about_text)
 
         layout.addWidget(help_text)
@@ -305,134 +754,507 @@ class ImageConverter(QWidget):
             self.update_zoom()
 
     def update_zoom(self):
+        """ Zoom only changes how the images are painted, encode parameters stay the same so nothing is converted """
         if self.image_path:
-            pixmap = QPixmap(self.image_path)
             scale_factor = SCALE_FACTORS[self.scale_index]
-            scaled_pixmap = pixmap.scaled(pixmap.width() * scale_factor // 100,
-                                          pixmap.height() * scale_factor // 100,
-                                          Qt.AspectRatioMode.KeepAspectRatio)
-            self.original_label.setPixmap(scaled_pixmap)
-            self.converted_label.setPixmap(scaled_pixmap)
+            self.original_label.set_zoom(scale_factor / 100)
+            self.converted_label.set_zoom(scale_factor / 100)
             self.zoom_label.setText(f"{scale_factor}%")
-            self.convert_image()
+            self.request_visible_tiles()
 
     def update_preview(self):
         self.compression_label.setText(f"{self.quality_slider.value()}%")
+        # User input always wins over speculative work
+        self._conversion_worker.stop_speculation()
+
+        if self.sender() is self.quality_slider:
+            self.request_draft()
 
         # Calculate dynamic delay based on last conversion time
         delay = max(100, min(300, self._last_conversion_time_ms))
         self._debounce_timer.start(delay)
 
+    def current_params(self):
+        """ (image path, quality, method, lossless) as set in the UI """
+        return (self.image_path, self.quality_slider.value(), int(self.method_combo.currentText()),
+                self.lossless_checkbox.isChecked())
+
+    def request_draft(self):
+        """ While the slider moves, show a fast draft, the chosen method is used once input is idle """
+        if not self.image_path or self.target_checkbox.isChecked() or self._animated:
+            return
+        image_path, quality, method, lossless = self.current_params()
+        if method <= DRAFT_METHOD:
+            return  # Final result is as fast as the draft
+        try:
+            if encoded_key(image_path, quality, method, lossless) in encoded_cache:
+                return  # Final result comes straight from the cache
+        except OSError as e:
+            print(f"Error converting image: {e}")  # Deleted or renamed since it was loaded
+            return
+
+        self._conversion_worker.request_draft(image_path, quality, lossless)
+        # Estimate is for the chosen method, the draft never provides the size
+        self._conversion_worker.request_estimate(image_path, quality, method, lossless)
+        self._conversion_start_time = perf_counter()
+
     def load_image(self, file_path=None):
         if file_path is None:
-            file_path, _ = QFileDialog.getOpenFileName(self, "Open Image", "",
-                                                       "Images (*.png *.jpg *.jpeg *.bmp *.webp)")
+            file_paths, _ = QFileDialog.getOpenFileNames(self, "Open Images", "",
+                                                         "Images (*.png *.jpg *.jpeg *.bmp *.gif *.webp)")
+            self.open_files(file_paths)
+            return
 
         if file_path:
+            self._conversion_worker.stop_speculation()
+            try:
+                viewport = self.original_scroll.viewport().size()
+                cached = decoded_cache.peek(file_path)
+                if cached is not None:
+                    # Decoded earlier in the session, a reduced copy of it replaces the draft decode
+                    factor = max(1, min(cached.width // max(1, viewport.width()),
+                                        cached.height // max(1, viewport.height())))
+                    draft, full_size = cached.reduce(factor) if factor > 1 else cached, cached.size
+                else:
+                    # Reduced resolution decode sized for the viewport is shown while the full image decodes,
+                    # formats that can only be decoded at full size are decoded once, by the worker
+                    draft, full_size = load_draft(file_path, (viewport.width(), viewport.height()), reduced_only=True)
+                animated = is_animated(file_path)
+            except Exception as e:
+                print(f"Error loading image: {e}")  # Replace with proper error dialog in UI
+                return
             self.image_path = file_path
+            # Animations are converted frame by frame, the still image previews and target size don't apply
+            self._animated = animated
+            if animated:
+                self.target_checkbox.setChecked(False)
+            self.target_checkbox.setEnabled(not animated)
+            self._source_image = None
+            self._source_size = decoded_size(full_size, decoded_cache.max_dimension)
+            placeholder = pil_to_qimage(draft) if draft is not None else None
+            # Converted pane shows the original until the first conversion arrives
+            self.original_label.set_image(placeholder, QSize(*self._source_size))
+            self.converted_label.set_image(placeholder, QSize(*self._source_size))
+            self._converted_is_placeholder = True
             self.update_zoom()
+            self._conversion_worker.request_load(file_path)
+            self._last_conversion_params = None
+            self._full_preview_params = None
+            self.convert_image()
             file_size = os.path.getsize(file_path) / 1024  # KB
             self.original_size_label.setText(f'Original Size: {file_size:.2f} KB')
             self.setWindowTitle("JPG/PNG/BMP to WEBP Converter - " + os.path.basename(self.image_path))
 
+    def open_files(self, paths):
+        """ Start a session with the given files and directories (searched recursively) and show the first image """
+        session = [(image_path, base_dir) for image_path, base_dir in collect_images(paths) if is_supported(image_path)]
+        if not session:
+            if paths:
+                print("No supported images found")  # Replace with proper error dialog in UI
+            return
+        self.session = session
+        self.thumbnail_strip.blockSignals(True)
+        self.thumbnail_strip.clear()
+        self._thumbnail_items = {}
+        for image_path, _ in session:
+            item = QListWidgetItem(os.path.basename(image_path))
+            item.setToolTip(image_path)
+            item.setSizeHint(QSize(THUMBNAIL_ICON_SIZE + 20, THUMBNAIL_ICON_SIZE + 30))
+            self.thumbnail_strip.addItem(item)
+            self._thumbnail_items[image_path] = item
+        self.thumbnail_strip.setCurrentRow(0)
+        self.thumbnail_strip.blockSignals(False)
+        self.thumbnail_strip.setVisible(len(session) > 1)
+        self.save_all_button.setEnabled(len(session) > 1)
+        if len(session) > 1:
+            self._thumbnail_session = self._thumbnail_loader.request(image_path for image_path, _ in session)
+        self.load_image(session[0][0])
+
+    def on_thumbnail_ready(self, session, image_path, image):
+        item = self._thumbnail_items.get(image_path)
+        if session != self._thumbnail_session or item is None or image.isNull():
+            return
+        item.setIcon(QIcon(QPixmap.fromImage(image)))
+
+    def on_thumbnail_selected(self, row):
+        """ Show another image of the session, decoded and encoded results still in the caches are reused """
+        if 0 <= row < len(self.session) and self.session[row][0] != self.image_path:
+            self.load_image(self.session[row][0])
+
+    def on_source_loaded(self, image_path, image):
+        if image_path != self.image_path:
+            return  # Another image was loaded meanwhile
+        self._source_image = image
+        self.original_label.set_image(image)
+        if self._converted_is_placeholder:
+            self.converted_label.set_image(image)
+
     def save_image(self):
-        file_name = os.path.splitext(self.image_path)[0]
         if self.image_path:
+            if self.target_checkbox.isChecked() and not self._target_result_current():
+                # The quality on the slider may not fit the target, the file would be over budget
+                print("Target size search hasn't finished yet, save again once the size is shown")
+                return
+            file_name = os.path.splitext(self.image_path)[0]
             save_path, _ = QFileDialog.getSaveFileName(self, 'Save Image', file_name, 'WEBP Files (*.webp)')
             if save_path:
                 try:
-                    img = Image.open(self.image_path).convert("RGBA")
-
                     # Get settings
                     quality = self.quality_slider.value()
+                    method = int(self.method_combo.currentText())
                     lossless = self.lossless_checkbox.isChecked()
 
-                    # Prepare parameters for saving
-                    save_params = {'format': 'WEBP'}
-                    if lossless:
-                        save_params['lossless'] = True
+                    if self.target_checkbox.isChecked():
+                        # Result of the target size search, it may be downscaled
+                        webp_data = self._target_result.data
                     else:
-                        save_params['quality'] = quality
-
-                    # Save image using Pillow
-                    img.save(save_path, **save_params)
+                        # Same bytes as the preview shows, taken from the cache when the preview is up to date
+                        webp_data = encode_to_webp(self.image_path, quality, method, lossless)
+                    with open(save_path, 'wb') as f:
+                        f.write(webp_data)
+                    self.request_metrics(full_resolution=True)
 
                 except Exception as e:
                     print(f"Error saving image: {e}")  # Replace with proper error dialog in UI
 
-    def convert_image(self):
+    def save_all(self):
+        """ Convert every image of the session with the current settings in parallel, the folder structure of
+        opened directories is kept """
+        if not self.session or self._save_all_state is not None:
+            return
+        output_dir = QFileDialog.getExistingDirectory(self, 'Save All', os.path.dirname(self.session[0][0]))
+        if not output_dir:
+            return
+        # Imported here, it loads NumPy for its metrics
+        from batch_convert import plan_jobs
+
+        _, quality, method, lossless = self.current_params()
+        target_kb = self.target_spinbox.value() if self.target_checkbox.isChecked() else None
+        jobs, existing, sources = plan_jobs(self.session, output_dir)
+        if sources:
+            print(f"Skipped {len(sources)} WebP file(s) whose output would overwrite the source")
+        if existing:
+            answer = QMessageBox.question(
+                self, 'Save All', f"{len(existing)} of the files exist in {output_dir} already. Overwrite them?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel,
+                QMessageBox.StandardButton.No)
+            if answer == QMessageBox.StandardButton.Cancel:
+                return
+            if answer == QMessageBox.StandardButton.Yes:
+                jobs, _, _ = plan_jobs(self.session, output_dir, overwrite=True)
+        if not jobs:
+            print("Nothing to save")  # Replace with proper error dialog in UI
+            return
+        self._save_all_state = [len(jobs), 0, [], perf_counter()]
+        self.save_all_progress.setRange(0, len(jobs))
+        self.save_all_progress.setValue(0)
+        self.save_all_progress.show()
+        self.save_all_button.setEnabled(False)
+        self._conversion_worker.save_all(jobs, quality, method, lossless, target_kb)
+
+    def on_save_progress(self, image_path, size, error):
+        state = self._save_all_state
+        if state is None:
+            return
+        state[0] -= 1
+        state[1] += size
+        if error:
+            state[2].append(image_path)
+            print(f"Error saving {image_path}: {error}")  # Replace with proper error dialog in UI
+        self.save_all_progress.setValue(self.save_all_progress.maximum() - state[0])
+        if state[0]:
+            return
+        left, saved, failed, start = state
+        self._save_all_state = None
+        self.save_all_progress.hide()
+        self.save_all_button.setEnabled(len(self.session) > 1)
+        count = self.save_all_progress.maximum() - len(failed)
+        failed = f", {len(failed)} failed" if failed else ""
+        self.converted_size_label.setText(f"Saved {count} images ({saved / 1024:.1f} KB) in "
+                                          f"{perf_counter() - start:.1f} s{failed}")
+
+    def export_sizes(self):
+        """ Save the responsive widths of the image with the current settings, decoded once from the cache """
         if not self.image_path:
             return
+        output_dir = QFileDialog.getExistingDirectory(self, 'Export Sizes', os.path.dirname(self.image_path))
+        if output_dir:
+            _, quality, method, lossless = self.current_params()
+            self._conversion_worker.request_export(self.image_path, output_dir, quality, method, lossless)
+            self.converted_size_label.setText("Exporting sizes...")
+
+    def on_export_finished(self, result, error):
+        if result is None:
+            print(error)  # Replace with proper error dialog in UI
+            self.converted_size_label.setText("Export failed")
+            return
+        widths = ", ".join(str(variant.width) for variant in result.variants)
+        total = sum(variant.size for variant in result.variants) / 1024
+        self.converted_size_label.setText(f"Exported widths {widths} ({total:.1f} KB) in {result.seconds:.1f} s")
 
-        self._conversion_start_time = perf_counter()
+    def convert_image(self):
+        if not self.image_path:
+            return
 
         quality = self.quality_slider.value()
         method = int(self.method_combo.currentText())
         lossless = self.lossless_checkbox.isChecked()
         file_name = self.image_path
 
-        params = (quality, method, lossless, file_name)
-        if params == self._last_conversion_params:
+        if self.target_checkbox.isChecked():
+            target_kb = self.target_spinbox.value()
+            params = (file_name, "target", target_kb, method)
+            if params == self._last_conversion_params:
+                return  # No change, skip
+            self._last_conversion_params = params
+            self._target_result = None
+            self.converted_size_label.setText(f'Searching quality for {target_kb} KB...')
+            self._conversion_worker.request_target(file_name, target_kb * 1024, method)
+            self._conversion_start_time = perf_counter()
+            return
+
+        params = (file_name, quality, method, lossless)
+        if params == self._last_conversion_params and not self._draft_shown:
             return  # No change, skip
         self._last_conversion_params = params
+        self._preview_tiles = set()
 
-        # Optional: attempt to stop any existing thread cleanly without accessing deleted objects
+        # Size estimate and visible region are computed on their own thread and shown before the full frame
         try:
-            if self._conversion_thread and self._conversion_thread.isRunning():
-                self._conversion_thread.quit()
-                self._conversion_thread.wait()
-        except RuntimeError:
-            # The thread was already deleted; safely ignore
-            pass
+            cached = encoded_key(file_name, quality, method, lossless) in encoded_cache
+        except OSError as e:
+            print(f"Error converting image: {e}")  # Deleted or renamed since it was loaded
+            return
+        if not cached and not self._animated:
+            self._conversion_worker.request_estimate(file_name, quality, method, lossless)
+        self.request_visible_tiles()
 
-        quality = self.quality_slider.value()
-        method = int(self.method_combo.currentText())
-        lossless = self.lossless_checkbox.isChecked()
+        # Never blocks: a running encode finishes in the background and its result is discarded
+        self._conversion_worker.request(self.image_path, quality, method, lossless)
+        self._conversion_start_time = perf_counter()
 
-        # Create new thread and worker each time
-        thread = QThread(self)
-        worker = ImageConversionWorker(self.image_path, quality, method, lossless)
-        worker.moveToThread(thread)
+    def on_conversion_finished(self, generation, data, estimated_size, image):
+        if not self._conversion_worker.is_current(generation):
+            return  # Superseded by a newer request
+        self._full_preview_params = self._last_conversion_params
+        self._draft_shown = False
 
-        thread.started.connect(worker.run)
-        worker.finished.connect(self.on_conversion_finished)
-        worker.finished.connect(thread.quit)
-        worker.finished.connect(worker.deleteLater)
-        thread.finished.connect(thread.deleteLater)
+        self.show_converted(image)
 
-        # Save references only while thread is alive
-        self._conversion_thread = thread
-        self._conversion_worker = worker
+        end = perf_counter()
+        recorder.add("preview", self._conversion_start_time, end)
+        duration = (end - self._conversion_start_time) * 1000  # ms
+        self._last_conversion_time_ms = int(duration)
+        _, p50, p95 = recorder.stats()["preview"]
+        self.show_timing(f"{duration:.0f} ms (p50 {p50:.0f}, p95 {p95:.0f})")
+        self.request_metrics()
 
-        thread.start()
+        animated = " (animated)" if self._animated else ""
+        self.converted_size_label.setText(f'Converted Size: {estimated_size:.2f} KB{animated}')
 
-    def on_conversion_finished(self, data, estimated_size):
-        pixmap = QPixmap()
-        pixmap.loadFromData(data, "WEBP")
+        # Show actual image size under original image
+        self.image_size_label.setText(f"Image size: {image.width()}x{image.height()} px")
 
-        # Show FPS
-        duration = (perf_counter() - self._conversion_start_time) * 1000  # ms
-        self._last_conversion_time_ms = int(duration)
+        self.speculate_neighbours()
 
-        if duration > 0:
-            fps = 1000.0 / duration
-            self.fps_overlay_label.setText(f"{fps:.1f} pfs")
-            self.fps_overlay_label.adjustSize()
+    def speculate_neighbours(self):
+        """ While idle, pre-encode nearby qualities so the next slider move shows instantly """
+        if not self.image_path or self.target_checkbox.isChecked() or self._animated:
+            return
+        if self._source_size[0] * self._source_size[1] > SPECULATIVE_MAX_MEGAPIXELS * 1_000_000:
+            return
+        image_path, quality, method, lossless = self.current_params()
+        qualities = [quality + offset for offset in SPECULATIVE_OFFSETS
+                     if self.quality_slider.minimum() <= quality + offset <= self.quality_slider.maximum()]
+        self._conversion_worker.speculate(image_path, qualities, method, lossless)
+
+    def show_timing(self, text):
+        """ Show a latency on the overlay and refresh the per-stage percentiles in its tooltip """
+        self.timing_overlay_label.setText(text)
+        self.timing_overlay_label.adjustSize()
+        rows = "".join(f"<tr><td>{name}</td><td align=right>{p50:.1f}</td><td align=right>{p95:.1f}</td>"
+                       f"<td align=right>{count}</td></tr>"
+                       for name, (count, p50, p95) in sorted(recorder.stats().items()))
+        self.timing_overlay_label.setToolTip(
+            f"<table><tr><th align=left>Stage</th><th>p50 ms</th><th>p95 ms</th><th>n</th></tr>{rows}</table>"
+            f"<p>Speculative encodes: {encoded_cache.speculative_puts}, used: {encoded_cache.speculative_hits}</p>")
+
+    def on_animation_progress(self, job, index, count, estimate, image):
+        """ First frame of an animation is shown as soon as it's encoded, the size estimate follows every frame """
+        if job != self._last_conversion_params or job == self._full_preview_params:
+            return  # Settings changed or the whole animation is already shown
+        if image is not None:
+            self.show_converted(image)
+            end = perf_counter()
+            recorder.add("first frame preview", self._conversion_start_time, end)
+            self.show_timing(f"First frame {(end - self._conversion_start_time) * 1000:.0f} ms")
+        self.converted_size_label.setText(f'Estimated Size: ~{estimate / 1024:.2f} KB (frame {index + 1}/{count})')
+
+    def on_draft_finished(self, generation, job, image):
+        if not self._conversion_worker.is_current_draft(generation):
+            return  # Superseded by a newer draft
+        image_path, quality, _, lossless = job
+        params = self.current_params()
+        if (image_path, quality, lossless) != (params[0], params[1], params[3]) or params == self._full_preview_params:
+            return  # Settings changed or the final conversion is already shown
+        self.show_converted(image)
+        # Pane no longer shows the final conversion, it has to be requested even if the settings return to it
+        self._draft_shown = True
+        end = perf_counter()
+        recorder.add("draft preview", self._conversion_start_time, end)
+        self.show_timing(f"Draft (method {DRAFT_METHOD}) {(end - self._conversion_start_time) * 1000:.0f} ms")
+
+    def show_converted(self, image):
+        """ Show a decoded conversion result in the converted pane """
+        with span("show"):
+            self.converted_label.set_image(image)
+        self._converted_is_placeholder = False
+        # Metrics and heatmap of the previous image don't apply anymore
+        self._metrics_job = None
+        self._heatmap = None
+        self.converted_label.set_overlay(None)
+        self.quality_label.setText("PSNR: -")
+
+    def request_metrics(self, full_resolution=False):
+        """ Queue PSNR/SSIM of the current settings, computed off the GUI thread and cached with the encode """
+        params = self._last_conversion_params
+        if params is None:
+            return
+        if params[1] == "target":
+            result = self._target_result
+            if result is None:
+                return
+            # Full size results are in the encoded cache, downscaled ones are compared from their bytes
+            job = (params[0], result.quality, params[3], False, result.data if result.scale < 1 else None)
         else:
-            self.fps_overlay_label.setText("0 pfs")
-            self.fps_overlay_label.adjustSize()
-
-        # Resize converted image
-        scale_factor = SCALE_FACTORS[self.scale_index]
-        scaled_pixmap = pixmap.scaled(pixmap.width() * scale_factor // 100,
-                                      pixmap.height() * scale_factor // 100,
-                                      Qt.AspectRatioMode.KeepAspectRatio)
-        self.converted_label.setPixmap(scaled_pixmap)
-        self.converted_label.adjustSize()
-        self.converted_size_label.setText(f'Estimated Size: {estimated_size:.2f} KB')
+            job = params + (None,)
+        if not full_resolution:
+            self._metrics_job = job
+        self._conversion_worker.request_metrics(*job, full_resolution=full_resolution)
+
+    def on_metrics_finished(self, job, metrics, overlay):
+        from quality_metrics import format_metrics
+
+        *job, full_resolution = job
+        if tuple(job) != self._metrics_job:
+            return  # Another conversion is shown meanwhile
+        if full_resolution:
+            self.quality_label.setText(f"{format_metrics(metrics)} (full resolution, saved)")
+            return
+        self.quality_label.setText(f"{format_metrics(metrics)} (at {metrics.size[0]}x{metrics.size[1]})")
+        self._heatmap = overlay
+        self.update_heatmap()
+
+    def update_heatmap(self):
+        self.converted_label.set_overlay(self._heatmap if self.heatmap_checkbox.isChecked() else None)
+
+    def visible_tiles(self):
+        """ Tiles of the source image visible in the converted pane, plus a margin """
+        scale = SCALE_FACTORS[self.scale_index] / 100
+        viewport = self.converted_scroll.viewport()
+        left = (self.converted_scroll.horizontalScrollBar().value() - PREVIEW_MARGIN) / scale
+        top = (self.converted_scroll.verticalScrollBar().value() - PREVIEW_MARGIN) / scale
+        right = left + (viewport.width() + 2 * PREVIEW_MARGIN) / scale
+        bottom = top + (viewport.height() + 2 * PREVIEW_MARGIN) / scale
+
+        width, height = self._source_size
+        columns = range(max(0, int(left) // PREVIEW_TILE_SIZE),
+                        min((width - 1) // PREVIEW_TILE_SIZE, int(right) // PREVIEW_TILE_SIZE) + 1)
+        rows = range(max(0, int(top) // PREVIEW_TILE_SIZE),
+                     min((height - 1) // PREVIEW_TILE_SIZE, int(bottom) // PREVIEW_TILE_SIZE) + 1)
+        return {(col, row) for col in columns for row in rows}
+
+    def request_visible_tiles(self):
+        """ Queue an encode of the newly exposed part of the viewport while the full frame isn't ready """
+        params = self._last_conversion_params
+        if (not self.progressive_checkbox.isChecked() or not self.image_path or params is None
+                or params == self._full_preview_params or self._animated):
+            return
 
-        # Show actual image size under original image
-        self.image_size_label.setText(f"Image size: {pixmap.width()}x{pixmap.height()} px")
+        image_path, quality, method, lossless = params
+        try:
+            if encoded_key(image_path, quality, method, lossless) in encoded_cache:
+                return  # Full frame comes straight from the cache
+        except OSError:
+            return  # Deleted or renamed since it was loaded, the conversion reports it
+
+        missing = self.visible_tiles() - self._preview_tiles
+        if not missing:
+            return
+        box = tile_box(missing, PREVIEW_TILE_SIZE, self._source_size)
+        if box == (0, 0) + self._source_size:
+            return  # Whole image is visible, the full frame encode is all we need
+
+        self._conversion_worker.request_region(image_path, box, quality, method, lossless)
+
+    def on_target_mode_changed(self, checked):
+        self.quality_slider.setEnabled(not checked)
+        self.lossless_checkbox.setEnabled(not checked)
+        self.target_spinbox.setEnabled(checked)
+        self.update_preview()
+
+    def _target_result_current(self):
+        """ True when the search result is for the image, target and method set in the UI """
+        return self._target_result is not None and self._last_conversion_params == (
+            self.image_path, "target", self.target_spinbox.value(), int(self.method_combo.currentText()))
+
+    def on_target_finished(self, generation, result, image):
+        if not self._conversion_worker.is_current(generation):
+            return  # Superseded by a newer request
+        self._target_result = result
+
+        # Show the quality that was found on the slider without starting a conversion
+        self.quality_slider.blockSignals(True)
+        self.quality_slider.setValue(result.quality)
+        self.quality_slider.blockSignals(False)
+        self.compression_label.setText(f"{result.quality}%")
+
+        self.on_conversion_finished(generation, result.data, len(result.data) / 1024, image)
+        details = f"quality {result.quality}, {result.encodes} encodes"
+        if result.scale < 1:
+            details += f", downscaled to {result.size[0]}x{result.size[1]}"
+        if not result.fits:
+            details += ", doesn't fit"
+        self.converted_size_label.setText(f'Converted Size: {len(result.data) / 1024:.2f} KB ({details})')
+
+    def on_estimate_finished(self, job, estimate):
+        if job != self.current_params() or job == self._full_preview_params:
+            return  # Settings changed or the exact size is already shown
+        self.converted_size_label.setText(f'Estimated Size: ~{estimate.size / 1024:.2f} KB '
+                                          f'({estimate.low / 1024:.0f}-{estimate.high / 1024:.0f} KB)')
+
+    def on_region_finished(self, generation, job, region):
+        image_path, box, quality, method, lossless = job
+        params = (image_path, quality, method, lossless)
+        if params != self._last_conversion_params or params == self._full_preview_params:
+            return  # Settings changed or the full frame is already shown
+        if region.isNull():
+            return
+
+        # Paint the encoded region over the current preview
+        self.converted_label.patch(box[0], box[1], region)
+
+        left, top, right, bottom = box
+        self._preview_tiles.update((col, row)
+                                   for col in range(left // PREVIEW_TILE_SIZE, (right - 1) // PREVIEW_TILE_SIZE + 1)
+                                   for row in range(top // PREVIEW_TILE_SIZE, (bottom - 1) // PREVIEW_TILE_SIZE + 1))
+
+        end = perf_counter()
+        recorder.add("viewport preview", self._conversion_start_time, end)
+        self.show_timing(f"viewport {(end - self._conversion_start_time) * 1000:.0f} ms")
+
+    def on_conversion_error(self, generation, message):
+        if self._conversion_worker.is_current(generation):
+            print(message)  # Replace with proper error dialog in UI
+
+    def closeEvent(self, event):
+        self._conversion_worker.shutdown()
+        self._thumbnail_loader.shutdown()
+        thumbnail_cache.prune()
+        trace_path = recorder.write_trace()
+        if trace_path:
+            print(f"Trace written to {trace_path}")
+        super().closeEvent(event)
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -441,16 +1263,22 @@ class ImageConverter(QWidget):
             event.ignore()
 
     def dropEvent(self, event):
-        urls = event.mimeData().urls()
-        if urls:
-            file_path = urls[0].toLocalFile()
-            self.load_image(file_path)
+        self.open_files([url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()])
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("IMAGE_CONVERTER_LOG_LEVEL", "WARNING"))
+    # Print where the startup time went and exit once the window is shown
+    startup_profile = "--startup-profile" in sys.argv
+    if startup_profile:
+        sys.argv.remove("--startup-profile")
     app = QApplication(sys.argv)
+    app_created = perf_counter()
     icon_path = resource_path('media/favicon.ico')
     app.setWindowIcon(QIcon(icon_path))
     converter = ImageConverter()
+    window_created = perf_counter()
     converter.show()
+    if startup_profile:
+        QTimer.singleShot(0, lambda: (print_startup_profile(app_created, window_created), app.quit()))
     sys.exit(app.exec())
@@ -10,7 +10,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Never imported by the app: tkinter and Pillow's Tk and Qt bridges
+    excludes=['tkinter', '_tkinter', 'PIL.ImageTk', 'PIL._tkinter_finder', 'PIL.ImageQt'],
     noarchive=False,
     optimize=0,
 )
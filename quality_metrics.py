@@ -0,0 +1,155 @@
+"""PSNR and SSIM between a source image and its WebP encode, vectorized with NumPy.
+
+Usage: python quality_metrics.py photo.jpg -q 80 -m 6
+"""
+import argparse
+import io
+import math
+import sys
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from converter_core import add_encoder_arguments, encode_image, load_image
+from timing import span
+
+# Longest side of the copies compared for interactive use, the full image is compared when saving and in batch
+INTERACTIVE_MAX_DIMENSION = 1024
+
+# SSIM over a uniform 7x7 window on luma, with the constants of the original paper for 8-bit data
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Rows compared at a time at full resolution, keeps memory bounded for very large images
+STRIP_HEIGHT = 256
+
+# Transparent pixels are compared over this gray, the encoder may change the colour of fully transparent pixels
+BACKGROUND = (128, 128, 128)
+
+QualityMetrics = namedtuple('QualityMetrics', 'psnr ssim size error_map')
+QualityMetrics.__doc__ = """Similarity of an encode to its source.
+
+psnr is in dB (inf when identical), ssim is 0..1. size is the (width, height) that was compared, error_map is
+None or a uint8 array of that size, 0 where the encode matches the source and 255 where the structure is lost.
+"""
+
+
+def _flatten(img):
+    """RGB copy of img with transparency composited over BACKGROUND."""
+    if img.mode == "RGBA":
+        background = Image.new("RGBA", img.size, BACKGROUND + (255,))
+        return Image.alpha_composite(background, img).convert("RGB")
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+def _window_sums(values, window):
+    """Sums over every window x window block of a 2D array ('valid' mode), from an integral image."""
+    integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0, dtype=np.float64), axis=1, out=integral[1:, 1:])
+    return (integral[window:, window:] - integral[:-window, window:]
+            - integral[window:, :-window] + integral[:-window, :-window])
+
+
+def _luma(rgb):
+    return rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114
+
+
+def _ssim_map(reference, distorted, window=SSIM_WINDOW):
+    """Per-window SSIM of two luma arrays, (height - window + 1) x (width - window + 1)."""
+    count = window * window
+    mu_x = _window_sums(reference, window) / count
+    mu_y = _window_sums(distorted, window) / count
+    # Sample covariance, like the reference implementation
+    scale = count / (count - 1)
+    var_x = (_window_sums(reference * reference, window) / count - mu_x * mu_x) * scale
+    var_y = (_window_sums(distorted * distorted, window) / count - mu_y * mu_y) * scale
+    cov = (_window_sums(reference * distorted, window) / count - mu_x * mu_y) * scale
+    return (((2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2))
+            / ((mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (var_x + var_y + SSIM_C2)))
+
+
+def compare_images(reference, distorted, max_dimension=None, error_map=False):
+    """PSNR and mean SSIM of distorted against reference, both Pillow images.
+
+    With max_dimension both are reduced first so the longest side fits, for a fast interactive result.
+    A distorted image of another size (a downscaled target size result) is compared with a resized reference.
+    """
+    if distorted.size != reference.size:
+        reference = reference.resize(distorted.size, Image.Resampling.LANCZOS)
+    if max_dimension and max(reference.size) > max_dimension:
+        factor = math.ceil(max(reference.size) / max_dimension)
+        reference, distorted = reference.reduce(factor), distorted.reduce(factor)
+    reference, distorted = _flatten(reference), _flatten(distorted)
+    width, height = reference.size
+    if min(width, height) < SSIM_WINDOW:
+        raise ValueError(f"image too small for SSIM: {width}x{height}")
+
+    squared_error = 0.0
+    ssim_sum = 0.0
+    ssim_count = 0
+    error = np.zeros((height, width), dtype=np.uint8) if error_map else None
+    margin = SSIM_WINDOW // 2
+    # Strips overlap by window - 1 rows so the windows of neighbouring strips join exactly
+    for top in range(0, height - SSIM_WINDOW + 1, STRIP_HEIGHT):
+        bottom = min(height, top + STRIP_HEIGHT + SSIM_WINDOW - 1)
+        box = (0, top, width, bottom)
+        x = np.asarray(reference.crop(box), dtype=np.float32)
+        y = np.asarray(distorted.crop(box), dtype=np.float32)
+        # Each row once for PSNR, the overlap is counted by the next strip
+        rows = bottom - top if bottom == height else STRIP_HEIGHT
+        squared_error += float(np.square(x[:rows] - y[:rows], dtype=np.float64).sum())
+        ssim = _ssim_map(_luma(x), _luma(y))
+        ssim_sum += float(ssim.sum())
+        ssim_count += ssim.size
+        if error is not None:
+            error[top + margin:top + margin + ssim.shape[0], margin:margin + ssim.shape[1]] = \
+                np.clip((1 - ssim) * 255, 0, 255).astype(np.uint8)
+
+    mse = squared_error / (width * height * 3)
+    psnr = math.inf if mse == 0 else 10 * math.log10(255 * 255 / mse)
+    return QualityMetrics(psnr, ssim_sum / ssim_count, (width, height), error)
+
+
+def webp_quality(img, webp_data, max_dimension=None, error_map=False):
+    """Compare a decoded source image with the WebP bytes encoded from it."""
+    with span("quality metrics", full=max_dimension is None):
+        with Image.open(io.BytesIO(webp_data)) as encoded:
+            encoded.load()
+            return compare_images(img, encoded, max_dimension, error_map)
+
+
+def heatmap(error_map):
+    """RGBA Pillow image of an error map: transparent where the encode matches, red where it differs most."""
+    alpha = np.minimum(error_map.astype(np.uint16) * 3, 255).astype(np.uint8)  # Make small errors visible
+    pixels = np.zeros(error_map.shape + (4,), dtype=np.uint8)
+    pixels[..., 0] = 255
+    pixels[..., 1] = 255 - alpha
+    pixels[..., 3] = alpha
+    return Image.fromarray(pixels, "RGBA")
+
+
+def format_metrics(metrics):
+    psnr = "inf" if math.isinf(metrics.psnr) else f"{metrics.psnr:.2f}"
+    return f"PSNR {psnr} dB, SSIM {metrics.ssim:.4f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure PSNR and SSIM of the WEBP encode of an image.")
+    parser.add_argument('image', help="source image")
+    add_encoder_arguments(parser)
+    parser.add_argument('--fast', action='store_true',
+                        help=f"compare copies reduced to {INTERACTIVE_MAX_DIMENSION} px like the GUI preview")
+    args = parser.parse_args(argv)
+
+    img = load_image(args.image)
+    webp_data = encode_image(img, args.quality, args.method, args.lossless)
+    metrics = webp_quality(img, webp_data, INTERACTIVE_MAX_DIMENSION if args.fast else None)
+    print(f"{args.image}: {len(webp_data) / 1024:.1f} KB, {format_metrics(metrics)} "
+          f"({metrics.size[0]}x{metrics.size[1]} compared)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Responsive image export: several widths (and qualities) of one image from a single decode.
+
+Usage: python responsive_variants.py photo.jpg -o site/img/ --widths 320,640,960,1280,1920 -q 80
+
+Every width is resampled from the next larger one instead of the full size original, the variants are encoded in
+parallel and listed in a <name>.srcset.json manifest plus a <name>.srcset.html <img> snippet. The wall time is
+compared with converting every variant separately from the original file.
+"""
+import argparse
+import html
+import json
+import os
+import sys
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from PIL import Image
+
+from converter_core import add_encoder_arguments, encode_image, int_list, load_image
+from timing import span
+
+DEFAULT_WIDTHS = (320, 640, 960, 1280, 1920)
+
+Variant = namedtuple('Variant', 'width height quality path size seconds')
+VariantsResult = namedtuple('VariantsResult', 'variants manifest_path html_path seconds')
+
+
+def variant_widths(widths, source_width):
+    """Requested widths without upscaling: larger ones are replaced by the source width, largest first."""
+    return sorted({min(width, source_width) for width in widths}, reverse=True)
+
+
+def build_pyramid(img, widths):
+    """{width: image} for the given widths, each level resampled from the previous, larger one."""
+    levels = {}
+    current = img
+    for width in variant_widths(widths, img.width):
+        if width != current.width:
+            height = max(1, round(img.height * width / img.width))
+            with span("resample", width=width):
+                current = current.resize((width, height), Image.Resampling.LANCZOS)
+        levels[width] = current
+    return levels
+
+
+def variant_name(stem, width, quality, qualities):
+    suffix = f"-{width}w" if len(qualities) == 1 else f"-{width}w-q{quality}"
+    return f"{stem}{suffix}.webp"
+
+
+def export_variants(img, name, output_dir, widths=DEFAULT_WIDTHS, qualities=(80,), method=6, lossless=False,
+                    workers=None):
+    """Encode every width x quality of a decoded image into output_dir and write the srcset manifests.
+
+    name is the file name stem of the outputs. Encodes run on a thread pool, the encoder releases the GIL.
+    """
+    start = perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    levels = build_pyramid(img, widths)
+
+    def encode(job):
+        width, quality = job
+        level = levels[width]
+        encode_start = perf_counter()
+        data = encode_image(level, quality, method, lossless)
+        path = os.path.join(output_dir, variant_name(name, width, quality, qualities))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return Variant(width, level.height, quality, path, len(data), perf_counter() - encode_start)
+
+    jobs = [(width, quality) for width in levels for quality in qualities]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        variants = list(pool.map(encode, jobs))
+
+    manifest_path = os.path.join(output_dir, f"{name}.srcset.json")
+    html_path = os.path.join(output_dir, f"{name}.srcset.html")
+    write_manifests(variants, img.size, manifest_path, html_path)
+    return VariantsResult(variants, manifest_path, html_path, perf_counter() - start)
+
+
+def write_manifests(variants, source_size, manifest_path, html_path):
+    """JSON list of the variants with a srcset per quality, and an <img> snippet using the first quality."""
+    srcsets = {}
+    for variant in sorted(variants, key=lambda v: v.width):
+        srcsets.setdefault(variant.quality, []).append(f"{os.path.basename(variant.path)} {variant.width}w")
+    manifest = {
+        'source_size': list(source_size),
+        'variants': [{'file': os.path.basename(v.path), 'width': v.width, 'height': v.height, 'quality': v.quality,
+                      'bytes': v.size} for v in variants],
+        'srcset': {str(quality): ", ".join(entries) for quality, entries in srcsets.items()},
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    quality = variants[0].quality
+    largest = max((v for v in variants if v.quality == quality), key=lambda v: v.width)
+    srcset = html.escape(", ".join(srcsets[quality]))
+    with open(html_path, 'w') as f:
+        f.write(f'<img src="{html.escape(os.path.basename(largest.path))}"\n'
+                f'     srcset="{srcset}"\n'
+                f'     sizes="(max-width: {largest.width}px) 100vw, {largest.width}px"\n'
+                f'     width="{largest.width}" height="{largest.height}" alt="" loading="lazy">\n')
+
+
+def single_file_seconds(image_path, widths, qualities, method, lossless, output_dir):
+    """Time of producing the same variants as separate conversions, each decoding and resizing the original."""
+    start = perf_counter()
+    with Image.open(image_path) as src:
+        source_width = src.width
+    for width in variant_widths(widths, source_width):
+        for quality in qualities:
+            img = load_image(image_path)
+            if width != img.width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+            data = encode_image(img, quality, method, lossless)
+            with open(os.path.join(output_dir, f"single-{width}-{quality}.webp"), 'wb') as f:
+                f.write(data)
+    return perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export several widths of images as WEBP with a srcset manifest.")
+    parser.add_argument('inputs', nargs='+', help="image files")
+    parser.add_argument('-o', '--output-dir', help="output directory, default is next to the source file")
+    parser.add_argument('--widths', type=int_list, default=list(DEFAULT_WIDTHS),
+                        help="comma separated widths in pixels (default 320,640,960,1280,1920)")
+    add_encoder_arguments(parser, quality_default=[80], quality_type=int_list,
+                          quality_help="quality 0-100, or several comma separated (default 80)",
+                          jobs_help="encoder threads")
+    parser.add_argument('--no-compare', action='store_true',
+                        help="don't time producing the variants as separate single-file conversions for comparison")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for image_path in args.inputs:
+        output_dir = args.output_dir or os.path.dirname(image_path) or '.'
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        try:
+            decode_start = perf_counter()
+            img = load_image(image_path)
+            decode_seconds = perf_counter() - decode_start
+            result = export_variants(img, name, output_dir, args.widths, args.quality, args.method, args.lossless,
+                                     args.jobs)
+        except Exception as e:
+            failed += 1
+            print(f"FAILED {image_path}: {e}")
+            continue
+        for variant in result.variants:
+            print(f"  {variant.path}: {variant.width}x{variant.height} q{variant.quality} "
+                  f"{variant.size / 1024:.1f} KB ({variant.seconds * 1000:.0f} ms)")
+        wall = decode_seconds + result.seconds
+        encode_total = sum(variant.seconds for variant in result.variants)
+        print(f"{image_path}: {len(result.variants)} variants in {wall * 1000:.0f} ms "
+              f"(decode {decode_seconds * 1000:.0f} ms once, encodes {encode_total * 1000:.0f} ms in total), "
+              f"manifest {result.manifest_path}")
+        if not args.no_compare:
+            with tempfile.TemporaryDirectory() as scratch:
+                single = single_file_seconds(image_path, args.widths, args.quality, args.method, args.lossless,
+                                             scratch)
+            print(f"  separate conversions: {single * 1000:.0f} ms, {single / wall:.1f}x the time")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
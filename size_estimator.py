@@ -0,0 +1,171 @@
+"""Fast WebP output size prediction from a few encoded sample tiles.
+
+Usage: python size_estimator.py photos/ -q 80 -m 6
+"""
+import argparse
+import math
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from converter_core import add_encoder_arguments, collect_images, encode_image, encode_region, load_image
+
+# RIFF + VP8 chunk headers, paid once per file and not per pixel
+CONTAINER_OVERHEAD = 32
+# Longest side of the downscaled copy the cost of cutting the image into tiles is measured on
+CALIBRATION_SIDE = 1024
+# Relative error the calibration leaves, measured on photos and screenshots with 256 px tiles
+MODEL_ERROR = 0.05
+# Lossless images with few colours are coded as a palette with references to repeated content anywhere in the
+# image, the calibration copy only sees part of that
+PALETTE_MODEL_ERROR = 0.15
+# More tiles are sampled, up to SAMPLE_ROUNDS grids of 4x as many, while the sampling error is above this
+TARGET_ERROR = 0.05
+SAMPLE_ROUNDS = 3
+
+SizeEstimate = namedtuple('SizeEstimate', 'size low high confidence encodes exact')
+SizeEstimate.__doc__ = """Predicted output size in bytes with a ~95% range (low, high).
+
+confidence is 0..1, it drops when the sampled tiles compress very differently from each other or the tiles needed
+a large correction. exact is True when the image was small enough to just encode it.
+"""
+
+
+def grid_box(image_size, tile_size, column, row):
+    """Tile of the regular grid that tiling_bias() cuts the image into, edge tiles are smaller."""
+    width, height = image_size
+    left, top = column * tile_size, row * tile_size
+    return left, top, min(left + tile_size, width), min(top + tile_size, height)
+
+
+def sample_boxes(image_size, tile_size=256, samples=8):
+    """Grid tiles spread evenly over the image: the tile under the centre of every cell of a grid with ~samples
+    cells. The same tile is never returned twice, so there are fewer when the image has fewer tiles."""
+    width, height = image_size
+    grid_columns, grid_rows = math.ceil(width / tile_size), math.ceil(height / tile_size)
+    columns = max(1, min(round(math.sqrt(samples * width / height)), grid_columns))
+    rows = max(1, min(math.ceil(samples / columns), grid_rows))
+    boxes = []
+    for row in range(rows):
+        for col in range(columns):
+            box = grid_box(image_size, tile_size, int((col + 0.5) * width / columns) // tile_size,
+                           int((row + 0.5) * height / rows) // tile_size)
+            if box not in boxes:
+                boxes.append(box)
+    return boxes
+
+
+def tiling_bias(img, quality, method, lossless, tile_size=256):
+    """Bytes of all tiles of img encoded on their own per byte of img encoded as a whole.
+
+    Every tile pays for its own headers and starts predicting from scratch, for flat screenshots that's a quarter
+    more than the whole image, for photos only a few percent.
+    """
+    tiles = 0
+    for row in range(math.ceil(img.height / tile_size)):
+        for column in range(math.ceil(img.width / tile_size)):
+            box = grid_box(img.size, tile_size, column, row)
+            tiles += len(encode_region(img, box, quality, method, lossless)) - CONTAINER_OVERHEAD
+    return (tiles + CONTAINER_OVERHEAD) / len(encode_image(img, quality, method, lossless))
+
+
+def estimate_webp_size(img, quality, method, lossless, tile_size=256, samples=8):
+    """Predict the WebP size of a decoded image by encoding sample tiles and extrapolating bytes per pixel.
+
+    The extrapolation is corrected by the tiling_bias() of a downscaled copy. Nearest neighbour keeps the hard
+    edges and the colours of screenshots, a smoothing filter would make them look like photos.
+    """
+    pixels = img.width * img.height
+    if pixels <= 2 * samples * tile_size * tile_size:
+        size = len(encode_image(img, quality, method, lossless))
+        return SizeEstimate(size, size, size, 1.0, 1, True)
+
+    tile_count = math.ceil(img.width / tile_size) * math.ceil(img.height / tile_size)
+    sampled = {}  # box: encoded bytes without the container
+    for sample_round in range(SAMPLE_ROUNDS):
+        for box in sample_boxes(img.size, tile_size, samples * 4 ** sample_round):
+            if box not in sampled:
+                tile_bytes = len(encode_region(img, box, quality, method, lossless)) - CONTAINER_OVERHEAD
+                sampled[box] = max(0, tile_bytes)
+        count = len(sampled)
+        tile_pixels = [(box[2] - box[0]) * (box[3] - box[1]) for box in sampled]
+        density = sum(sampled.values()) / sum(tile_pixels)
+        if count < 2 or density == 0:
+            continue
+        # Ratio estimator, edge tiles are smaller. Standard error with finite population correction, tiles are
+        # sampled without replacement.
+        residuals = [tile_bytes - density * pixel_count
+                     for tile_bytes, pixel_count in zip(sampled.values(), tile_pixels)]
+        variance = sum(r * r for r in residuals) / (count - 1)
+        mean_pixels = sum(tile_pixels) / count
+        relative_error = math.sqrt(variance / count * (1 - count / tile_count)) / (density * mean_pixels)
+        if relative_error <= TARGET_ERROR:
+            break
+    if count < 2 or density == 0:
+        size = round(density * pixels) + CONTAINER_OVERHEAD
+        return SizeEstimate(size, CONTAINER_OVERHEAD, size * 2, 0.0, count, False)
+
+    scale = min(1.0, CALIBRATION_SIDE / max(img.size))
+    small = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                       Image.Resampling.NEAREST)
+    bias = tiling_bias(small, quality, method, lossless, tile_size)
+    size = round(density * pixels / bias) + CONTAINER_OVERHEAD
+
+    model_error = PALETTE_MODEL_ERROR if lossless and small.getcolors(256) else MODEL_ERROR
+    # The correction is measured on another image, the larger it is the less it can be trusted
+    model_error = math.hypot(model_error, (bias - 1) / 2)
+    spread = 2 * math.hypot(relative_error, model_error)  # ~95% interval
+    # Multiplicative, sizes can't go below zero however uncertain the estimate
+    low = round(size / (1 + spread))
+    high = round(size * (1 + spread))
+    confidence = max(0.0, min(1.0, 1 - spread))
+    encodes = count + math.ceil(small.width / tile_size) * math.ceil(small.height / tile_size) + 1
+    return SizeEstimate(size, low, high, confidence, encodes, False)
+
+
+def estimate_file(image_path, quality, method, lossless, tile_size=256, samples=8):
+    return estimate_webp_size(load_image(image_path), quality, method, lossless, tile_size, samples)
+
+
+def _estimate_job(image_path, quality, method, lossless):
+    try:
+        return image_path, estimate_file(image_path, quality, method, lossless), None
+    except Exception as e:
+        return image_path, None, str(e)
+
+
+def estimate_files(paths, quality, method, lossless, workers=None):
+    """Estimate the output size of every image under paths, yields (image_path, SizeEstimate or None, error)."""
+    image_paths = [image_path for image_path, _ in collect_images(paths)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_estimate_job, image_paths, [quality] * len(image_paths),
+                            [method] * len(image_paths), [lossless] * len(image_paths), chunksize=4)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict WEBP output size without converting everything.")
+    parser.add_argument('inputs', nargs='+', help="image files or directories")
+    add_encoder_arguments(parser, jobs_help="worker processes")
+    args = parser.parse_args(argv)
+
+    total = low = high = 0
+    failed = 0
+    for image_path, estimate, error in estimate_files(args.inputs, args.quality, args.method, args.lossless,
+                                                      args.jobs):
+        if error:
+            failed += 1
+            print(f"FAILED {image_path}: {error}")
+            continue
+        total += estimate.size
+        low += estimate.low
+        high += estimate.high
+        print(f"{image_path}: ~{estimate.size / 1024:.1f} KB ({estimate.low / 1024:.1f}-{estimate.high / 1024:.1f} KB, "
+              f"confidence {estimate.confidence:.0%})")
+    print(f"Total: ~{total / 1024 / 1024:.2f} MB ({low / 1024 / 1024:.2f}-{high / 1024 / 1024:.2f} MB)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
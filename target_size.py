@@ -0,0 +1,95 @@
+"""Search for the highest WebP quality that fits a file size budget."""
+import math
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from converter_core import encode_image
+
+TargetSizeResult = namedtuple('TargetSizeResult', 'quality scale size data encodes fits')
+TargetSizeResult.__doc__ = """Outcome of a target size search.
+
+scale is 1.0 unless the image had to be downscaled to fit, size is the (width, height) that was encoded.
+encodes is the number of probe encodes the search ran, fits is False when even the smallest attempt is too big.
+"""
+
+
+def find_quality_for_size(img, target_bytes, method=6, encode=None, sizes=None, min_quality=10, max_quality=100,
+                          parallel=3, max_downscales=4):
+    """Find the highest lossy quality whose output is not larger than target_bytes.
+
+    Quality is searched by interpolating log(size) between the known bracket, while the other parallel probes
+    bisect the rest of it, so every round narrows the bracket even when the interpolation guess is off.
+    When the minimum quality is still too big, the image is downscaled and searched again.
+
+    encode(image, quality, scale) returns WebP bytes, by default the image is encoded directly. sizes maps
+    (quality, scale) to output size and can be shared between searches to reuse earlier probes.
+    """
+    if encode is None:
+        def encode(image, quality, scale):
+            return encode_image(image, quality, method, False)
+    sizes = {} if sizes is None else sizes
+    encodes = 0
+    best = None  # (quality, data) of the best fitting probe at the current scale
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        scale = 1.0
+        image = img
+        for attempt in range(max_downscales + 1):
+            best = None
+
+            def probe(qualities):
+                nonlocal encodes, best
+                todo = sorted({q for q in qualities if (q, scale) not in sizes})
+                for quality, data in zip(todo, pool.map(lambda q: encode(image, q, scale), todo)):
+                    encodes += 1
+                    sizes[(quality, scale)] = len(data)
+                    if len(data) <= target_bytes and (best is None or quality > best[0]):
+                        best = quality, data
+
+            probe([min_quality, max_quality, (min_quality + max_quality) // 2][:max(2, parallel)])
+            if sizes[(min_quality, scale)] > target_bytes:
+                if attempt == max_downscales:
+                    break
+                # Size is roughly proportional to the pixel count, aim a bit below the budget
+                scale *= min(0.9, math.sqrt(target_bytes / sizes[(min_quality, scale)]) * 0.95)
+                image = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                                   Image.Resampling.LANCZOS)
+                continue
+
+            low, high = _bracket(sizes, scale, target_bytes, min_quality, max_quality)
+            while high is not None and high - low > 1:
+                probe(_candidates(low, high, sizes[(low, scale)], sizes[(high, scale)], target_bytes, parallel))
+                low, high = _bracket(sizes, scale, target_bytes, low, high)
+
+            if best is None or best[0] != low:
+                best = low, encode(image, low, scale)  # Size came from an earlier search, get the bytes
+                encodes += 1
+            return TargetSizeResult(low, scale, image.size, best[1], encodes, True)
+
+    # Doesn't fit even downscaled, return the smallest attempt
+    data = encode(image, min_quality, scale)
+    return TargetSizeResult(min_quality, scale, image.size, data, encodes + 1, False)
+
+
+def _bracket(sizes, scale, target_bytes, low, high):
+    """Highest known fitting quality in [low, high] and the lowest known quality above it that doesn't fit."""
+    known = sorted(q for q, s in sizes if s == scale and low <= q <= high)
+    fitting = [q for q in known if sizes[(q, scale)] <= target_bytes]
+    low = max(fitting)
+    too_big = [q for q in known if q > low and sizes[(q, scale)] > target_bytes]
+    return low, (min(too_big) if too_big else None)
+
+
+def _candidates(low, high, low_size, high_size, target_bytes, count):
+    """Qualities to probe strictly between low and high: one interpolated guess plus evenly spread ones."""
+    if high_size > low_size > 0:
+        position = (math.log(target_bytes) - math.log(low_size)) / (math.log(high_size) - math.log(low_size))
+    else:
+        position = 0.5
+    guess = min(high - 1, max(low + 1, round(low + (high - low) * position)))
+    candidates = {guess}
+    for i in range(1, count):
+        candidates.add(min(high - 1, max(low + 1, round(low + (high - low) * i / count))))
+    return sorted(candidates)
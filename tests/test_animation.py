@@ -0,0 +1,93 @@
+import io
+import struct
+
+from PIL import Image, ImageDraw
+
+from animation import animation_to_webp, changed_box, frame_bitstream
+
+
+def make_gif(path, frames, durations):
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=durations, loop=0, disposal=1)
+
+
+def drawn_frames():
+    """Four frames: a moving square (starting at an odd x), then a repeat of the last frame."""
+    frames = []
+    for x in (3, 21, 41):
+        frame = Image.new("RGB", (64, 48), (20, 40, 60))
+        ImageDraw.Draw(frame).rectangle((x, 11, x + 12, 30), fill=(250, 200, 10))
+        frames.append(frame)
+    frames.append(frames[-1].copy())
+    return frames
+
+
+def decoded_frames(webp_data):
+    with Image.open(io.BytesIO(webp_data)) as webp:
+        result = []
+        for index in range(webp.n_frames):
+            webp.seek(index)
+            result.append((webp.convert("RGBA"), webp.info['duration']))
+        return result
+
+
+def test_lossless_round_trip_keeps_pixels_and_merges_repeated_frames(tmp_path):
+    source = tmp_path / "moving.gif"
+    make_gif(source, drawn_frames(), [100, 120, 140, 160])
+
+    webp_data = animation_to_webp(str(source), 80, 4, True)
+
+    with Image.open(source) as gif:
+        expected = []
+        for index in range(gif.n_frames):
+            gif.seek(index)
+            expected.append(gif.convert("RGBA"))
+    frames = decoded_frames(webp_data)
+    assert len(frames) == 3  # The repeated last frame is merged into the one before it
+    assert [duration for _, duration in frames] == [100, 120, 300]
+    for (frame, _), original in zip(frames, expected):
+        assert frame.tobytes() == original.tobytes()
+
+
+def test_riff_sizes_are_consistent(tmp_path):
+    source = tmp_path / "moving.gif"
+    make_gif(source, drawn_frames(), [100] * 4)
+
+    webp_data = animation_to_webp(str(source), 60, 0, False)
+
+    assert webp_data[:4] == b'RIFF' and webp_data[8:12] == b'WEBP'
+    assert struct.unpack('<I', webp_data[4:8])[0] == len(webp_data) - 8
+    chunks = []
+    position = 12
+    while position < len(webp_data):
+        size = struct.unpack('<I', webp_data[position + 4:position + 8])[0]
+        chunks.append(webp_data[position:position + 4])
+        position += 8 + size + (size & 1)
+    assert position == len(webp_data)
+    assert chunks == [b'VP8X', b'ANIM', b'ANMF', b'ANMF', b'ANMF']
+
+
+def test_changed_box_has_even_offsets():
+    previous = Image.new("RGBA", (32, 32), (0, 0, 0, 255))
+    frame = previous.copy()
+    frame.putpixel((5, 7), (255, 0, 0, 255))
+
+    assert changed_box(previous, frame) == (4, 6, 6, 8)
+    assert changed_box(previous, previous.copy()) is None
+
+
+def test_changed_box_sees_color_changes_under_opaque_alpha():
+    previous = Image.new("RGBA", (8, 8), (0, 0, 0, 255))
+    frame = previous.copy()
+    frame.putpixel((2, 2), (0, 0, 255, 255))
+
+    assert changed_box(previous, frame) == (2, 2, 3, 3)
+
+
+def test_frame_bitstream_keeps_only_image_chunks():
+    buffer = io.BytesIO()
+    Image.new("RGBA", (16, 16), (10, 20, 30, 128)).save(buffer, "WEBP", quality=50)
+
+    bitstream = frame_bitstream(buffer.getvalue())
+
+    assert bitstream[:4] in (b'ALPH', b'VP8L')
+    assert b'VP8X' not in bitstream
@@ -0,0 +1,45 @@
+import os
+
+from PIL import Image
+
+from batch_convert import main, plan_jobs
+
+
+def make_images(directory):
+    os.makedirs(directory, exist_ok=True)
+    Image.new("RGB", (16, 16), (200, 10, 10)).save(os.path.join(directory, "photo.png"))
+    Image.new("RGB", (16, 16), (10, 200, 10)).save(os.path.join(directory, "x.webp"), lossless=True)
+    return [(os.path.join(directory, name), directory) for name in ("photo.png", "x.webp")]
+
+
+def test_webp_source_is_never_its_own_output(tmp_path):
+    images = make_images(str(tmp_path))
+
+    for overwrite in (False, True):
+        jobs, existing, sources = plan_jobs(images, str(tmp_path), overwrite)
+        assert jobs == [(images[0][0], str(tmp_path / "photo.webp"))]
+        assert existing == [] and sources == [images[1][0]]
+
+
+def test_existing_outputs_are_only_converted_with_overwrite(tmp_path):
+    images = make_images(str(tmp_path / "in"))
+    output_dir = tmp_path / "out"
+    os.makedirs(output_dir)
+    (output_dir / "photo.webp").write_bytes(b"old")
+
+    jobs, existing, sources = plan_jobs(images, str(output_dir))
+    assert jobs == [(images[1][0], str(output_dir / "x.webp"))]
+    assert existing == [(images[0][0], str(output_dir / "photo.webp"))] and sources == []
+
+    jobs, existing, _ = plan_jobs(images, str(output_dir), overwrite=True)
+    assert len(jobs) == 2 and existing == []
+
+
+def test_batch_keeps_webp_sources(tmp_path):
+    make_images(str(tmp_path))
+    source = (tmp_path / "x.webp").read_bytes()
+
+    assert main([str(tmp_path), '-o', str(tmp_path), '--overwrite', '-m', '0', '-j', '1']) == 0
+
+    assert (tmp_path / "x.webp").read_bytes() == source
+    assert os.path.getsize(tmp_path / "photo.webp") > 0
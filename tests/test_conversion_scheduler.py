@@ -0,0 +1,111 @@
+import threading
+
+from conversion_scheduler import IdleTaskRunner, LatestWinsScheduler
+
+TIMEOUT = 5
+
+
+class Recorder:
+    """Handler whose first job blocks until release() so later submissions queue up behind it."""
+
+    def __init__(self, expected):
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.done = threading.Event()
+        self.expected = expected
+        self.ran = []
+        self.results = []
+        self.errors = []
+
+    def handler(self, job):
+        self.started.set()
+        self.released.wait(TIMEOUT)
+        if job == "fail":
+            raise ValueError(job)
+        return job.upper()
+
+    def on_result(self, generation, channel, job, result):
+        self._finish(self.results, (generation, channel, job, result))
+
+    def on_error(self, generation, channel, job, exception):
+        self._finish(self.errors, (channel, job, type(exception)))
+
+    def _finish(self, target, item):
+        target.append(item)
+        self.ran.append(item[2] if target is self.results else item[1])
+        if len(self.ran) == self.expected:
+            self.done.set()
+
+
+def test_newer_job_replaces_waiting_one_of_the_same_channel():
+    recorder = Recorder(expected=2)
+    scheduler = LatestWinsScheduler(recorder.handler, recorder.on_result, recorder.on_error)
+    try:
+        first = scheduler.submit("a")
+        assert recorder.started.wait(TIMEOUT)
+        scheduler.submit("b")
+        assert scheduler.has_newer()
+        latest = scheduler.submit("c")
+        recorder.released.set()
+
+        assert recorder.done.wait(TIMEOUT)
+        assert recorder.ran == ["a", "c"]  # "b" was dropped before it started
+        assert not scheduler.is_current(first) and scheduler.is_current(latest)
+        assert recorder.results[-1] == (latest, "preview", "c", "C")
+    finally:
+        scheduler.shutdown(wait=True)
+
+
+def test_channels_keep_their_own_job_and_run_by_priority():
+    recorder = Recorder(expected=4)
+    scheduler = LatestWinsScheduler(recorder.handler, recorder.on_result, recorder.on_error)
+    try:
+        scheduler.submit("busy", channel="busy")
+        assert recorder.started.wait(TIMEOUT)
+        scheduler.submit("metrics", channel="metrics", priority=1)
+        scheduler.submit("preview", channel="preview")
+        scheduler.submit("load", channel="load", priority=-1)
+        recorder.released.set()
+
+        assert recorder.done.wait(TIMEOUT)
+        assert recorder.ran == ["busy", "load", "preview", "metrics"]
+    finally:
+        scheduler.shutdown(wait=True)
+
+
+def test_errors_go_to_on_error_and_the_worker_keeps_running():
+    recorder = Recorder(expected=2)
+    recorder.released.set()
+    scheduler = LatestWinsScheduler(recorder.handler, recorder.on_result, recorder.on_error)
+    try:
+        scheduler.submit("fail", channel="one")
+        scheduler.submit("ok", channel="two")
+
+        assert recorder.done.wait(TIMEOUT)
+        assert recorder.errors == [("one", "fail", ValueError)]
+        assert [job for _, _, job, _ in recorder.results] == ["ok"]
+    finally:
+        scheduler.shutdown(wait=True)
+
+
+def test_idle_runner_waits_for_idle_and_replace_drops_old_tasks():
+    idle = threading.Event()
+    done = threading.Event()
+    ran = []
+
+    def handler(task):
+        ran.append(task)
+        if task == "z":
+            done.set()
+
+    runner = IdleTaskRunner(handler, idle.is_set, poll_interval=0.01)
+    try:
+        runner.replace(["a", "b"])
+        runner.replace(["y", "z"])
+        assert not done.wait(0.1) and ran == []  # Nothing runs while the foreground is busy
+        idle.set()
+
+        assert done.wait(TIMEOUT)
+        assert ran == ["y", "z"]
+    finally:
+        runner.shutdown()
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from converter_core import downscale_in_strips, image_nbytes, pop_copy_counts
+
+SIZE = (301, 700)
+TARGET = (97, 225)
+
+
+def source(mode):
+    rng = np.random.default_rng(5)
+    img = Image.fromarray(rng.integers(0, 256, (70, 30, 4), dtype=np.uint8), "RGBA").resize(SIZE)
+    if mode == "P":
+        img = img.convert("RGB").quantize(64)
+        img.info["transparency"] = 3
+        return img
+    return img.convert(mode)
+
+
+def premultiplied(img):
+    pixels = np.asarray(img, dtype=np.float64)
+    if img.mode == "RGBA":
+        return pixels[..., :3] * pixels[..., 3:] / 255
+    return pixels
+
+
+@pytest.mark.parametrize("mode, expected_mode", [("RGB", "RGB"), ("L", "L"), ("RGBA", "RGBA"), ("P", "RGBA"),
+                                                 ("CMYK", "RGB")])
+def test_downscale_in_strips_matches_whole_image(mode, expected_mode):
+    img = source(mode)
+    pop_copy_counts()
+    result = downscale_in_strips(img, TARGET, strip_height=64)
+    counts = pop_copy_counts()
+
+    whole = img.convert(expected_mode).resize(TARGET, Image.Resampling.LANCZOS)
+    assert (result.mode, result.size) == (expected_mode, TARGET)
+    assert np.abs(premultiplied(result) - premultiplied(whole)).max() <= 2
+    # Converted a strip at a time, never the whole source at once
+    strips, converted = counts["downscale rows"]
+    assert strips == 4 and converted / strips < image_nbytes(img.convert(expected_mode)) / 2
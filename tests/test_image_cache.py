@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import image_cache
+from image_cache import DecodedImageCache, EncodedCache, encode_to_webp, pre_encode
+
+# Pillow keeps RGB with a padding byte, see image_nbytes()
+TILE_BYTES = 32 * 32 * 4
+
+
+def make_file(tmp_path, name, size=(32, 32), color=(200, 40, 40)):
+    path = tmp_path / name
+    Image.new("RGB", size, color).save(path)
+    return str(path)
+
+
+def counting_load(monkeypatch, delay=0.0):
+    """Replace the decoder of the caches, returns the list of decoded paths."""
+    loads = []
+    load_image = image_cache.load_image
+
+    def load(image_path, max_dimension=None):
+        loads.append(image_path)
+        time.sleep(delay)
+        return load_image(image_path, max_dimension)
+
+    monkeypatch.setattr(image_cache, "load_image", load)
+    return loads
+
+
+def test_decoded_hit_returns_same_image(tmp_path, monkeypatch):
+    loads = counting_load(monkeypatch)
+    path = make_file(tmp_path, "a.png")
+    cache = DecodedImageCache(10 * TILE_BYTES)
+
+    first = cache.get(path)
+    assert cache.get(path) is first
+    assert cache.peek(path) is first
+    assert loads == [path]
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.used_bytes == TILE_BYTES
+
+
+def test_decoded_invalidated_when_file_changes(tmp_path, monkeypatch):
+    loads = counting_load(monkeypatch)
+    path = make_file(tmp_path, "a.png")
+    cache = DecodedImageCache(10 * TILE_BYTES)
+    first = cache.get(path)
+
+    # Same size, only the modification time changes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.peek(path) is None
+    second = cache.get(path)
+    assert second is not first
+
+    # Different content and size
+    make_file(tmp_path, "a.png", size=(16, 16))
+    third = cache.get(path)
+    assert third.size == (16, 16)
+    assert len(loads) == 3
+    # The stale entries were dropped, not kept next to the new one
+    assert len(cache) == 1 and cache.used_bytes == 16 * 16 * 4
+
+
+def test_decoded_evicts_least_recently_used_at_cap(tmp_path, monkeypatch):
+    counting_load(monkeypatch)
+    paths = [make_file(tmp_path, f"{name}.png") for name in "abc"]
+    cache = DecodedImageCache(2 * TILE_BYTES)
+
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])  # a is now the most recently used
+    cache.get(paths[2])
+
+    assert cache.used_bytes == 2 * TILE_BYTES <= cache.max_bytes
+    assert cache.peek(paths[1]) is None
+    assert cache.peek(paths[0]) is not None and cache.peek(paths[2]) is not None
+
+
+def test_decoded_image_larger_than_cache_is_not_kept(tmp_path, monkeypatch):
+    loads = counting_load(monkeypatch)
+    path = make_file(tmp_path, "big.png", size=(64, 64))
+    cache = DecodedImageCache(TILE_BYTES)
+
+    assert cache.get(path).size == (64, 64)
+    assert len(cache) == 0 and cache.used_bytes == 0
+    cache.get(path)
+    assert len(loads) == 2
+
+
+def test_decoded_once_when_requested_concurrently(tmp_path, monkeypatch):
+    loads = counting_load(monkeypatch, delay=0.2)
+    path = make_file(tmp_path, "a.png")
+    cache = DecodedImageCache(10 * TILE_BYTES)
+    start = threading.Barrier(8)
+    results = []
+
+    def get():
+        start.wait()
+        results.append(cache.get(path))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loads == [path]
+    assert len(results) == 8 and all(img is results[0] for img in results)
+
+
+def test_encoded_stays_within_byte_budget_and_evicts_lru():
+    cache = EncodedCache(100)
+    cache.put("a", b"a" * 40)
+    cache.put("b", b"b" * 40)
+    assert cache.get("a") == b"a" * 40  # b is now the least recently used
+    cache.put("c", b"c" * 40)
+
+    assert cache.used_bytes == 80 <= cache.max_bytes
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.put("a", b"a" * 10)  # Replacing an entry frees its old bytes
+    assert cache.used_bytes == 50
+    cache.put("huge", b"x" * 101)  # Larger than the whole cache, not kept
+    assert "huge" not in cache and cache.used_bytes == 50
+
+
+def test_encoded_speculative_counters():
+    cache = EncodedCache(1000)
+    cache.put("guess", b"1", speculative=True)
+    cache.put("unused", b"2", speculative=True)
+    cache.put("asked", b"3")
+
+    cache.get("guess")
+    cache.get("guess")  # A speculative entry counts as used once
+    cache.get("asked")
+    assert (cache.speculative_puts, cache.speculative_hits) == (2, 1)
+
+    cache.put("unused", b"4")  # Encoded again on request, it was never used speculatively
+    cache.get("unused")
+    assert cache.speculative_hits == 1
+
+
+@pytest.fixture
+def fresh_caches(monkeypatch):
+    """Empty module caches and an encoder that never returns the same bytes twice."""
+    monkeypatch.setattr(image_cache, "decoded_cache", DecodedImageCache(10 * TILE_BYTES))
+    monkeypatch.setattr(image_cache, "encoded_cache", EncodedCache(1000))
+    encodes = []
+
+    def encode_image(img, quality, method, lossless):
+        encodes.append(quality)
+        return b"RIFF%d" % len(encodes)
+
+    monkeypatch.setattr(image_cache, "encode_image", encode_image)
+    return encodes
+
+
+def test_save_writes_previewed_bytes(tmp_path, fresh_caches):
+    path = make_file(tmp_path, "a.png")
+    preview = encode_to_webp(path, 80, 4, False)
+
+    # Another preview in between, and the decoded image is gone
+    encode_to_webp(path, 50, 4, False)
+    image_cache.decoded_cache.clear()
+
+    saved = encode_to_webp(path, 80, 4, False)
+    assert saved == preview
+    assert fresh_caches == [80, 50]
+
+
+def test_save_uses_speculative_encode(tmp_path, fresh_caches):
+    path = make_file(tmp_path, "a.png")
+    assert pre_encode(path, 70, 4, False, max_cache_bytes=1000)
+    assert not pre_encode(path, 70, 4, False, max_cache_bytes=1000)  # Cached already
+
+    preview = encode_to_webp(path, 70, 4, False)
+    assert encode_to_webp(path, 70, 4, False) == preview
+    assert fresh_caches == [70]
+    assert (image_cache.encoded_cache.speculative_puts, image_cache.encoded_cache.speculative_hits) == (1, 1)
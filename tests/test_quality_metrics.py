@@ -0,0 +1,81 @@
+import math
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from quality_metrics import SSIM_C1, SSIM_C2, SSIM_WINDOW, STRIP_HEIGHT, compare_images
+
+
+def gradient(width, height):
+    x = np.linspace(0, 255, width)[None, :, None]
+    y = np.linspace(0, 255, height)[:, None, None]
+    pixels = np.concatenate([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    return pixels.astype(np.uint8)
+
+
+def noisy(pixels, seed=1, amount=12):
+    noise = np.random.default_rng(seed).normal(0, amount, pixels.shape)
+    return np.clip(pixels + noise, 0, 255).astype(np.uint8)
+
+
+def direct_metrics(reference, distorted):
+    """PSNR and SSIM map over the whole image at once, straight from the definitions."""
+    x = reference.astype(np.float64)
+    y = distorted.astype(np.float64)
+    psnr = 10 * math.log10(255 * 255 / np.mean((x - y) ** 2))
+
+    weights = np.array([0.299, 0.587, 0.114])
+    windows_x = np.lib.stride_tricks.sliding_window_view(x @ weights, (SSIM_WINDOW, SSIM_WINDOW))
+    windows_y = np.lib.stride_tricks.sliding_window_view(y @ weights, (SSIM_WINDOW, SSIM_WINDOW))
+    mu_x = windows_x.mean(axis=(2, 3))
+    mu_y = windows_y.mean(axis=(2, 3))
+    var_x = windows_x.var(axis=(2, 3), ddof=1)
+    var_y = windows_y.var(axis=(2, 3), ddof=1)
+    cov = ((windows_x - mu_x[..., None, None]) * (windows_y - mu_y[..., None, None])).sum(axis=(2, 3))
+    cov /= SSIM_WINDOW * SSIM_WINDOW - 1
+    ssim = (((2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2))
+            / ((mu_x ** 2 + mu_y ** 2 + SSIM_C1) * (var_x + var_y + SSIM_C2)))
+    return psnr, ssim
+
+
+def test_identical_images():
+    img = Image.fromarray(noisy(gradient(40, 30)))
+    metrics = compare_images(img, img.copy())
+
+    assert math.isinf(metrics.psnr)
+    assert metrics.ssim == pytest.approx(1.0)
+    assert metrics.size == (40, 30)
+
+
+@pytest.mark.parametrize("height", [SSIM_WINDOW, 40, STRIP_HEIGHT + SSIM_WINDOW - 1, STRIP_HEIGHT + SSIM_WINDOW,
+                                    STRIP_HEIGHT + SSIM_WINDOW + 1, 2 * STRIP_HEIGHT + SSIM_WINDOW])
+def test_matches_direct_computation_across_strips(height):
+    reference = gradient(24, height)
+    distorted = noisy(reference)
+    metrics = compare_images(Image.fromarray(reference), Image.fromarray(distorted), error_map=True)
+    psnr, ssim = direct_metrics(reference, distorted)
+
+    assert metrics.psnr == pytest.approx(psnr, rel=1e-9)
+    assert metrics.ssim == pytest.approx(ssim.mean(), rel=1e-6)
+    # Every window row is in the error map once, the margin that no window is centred on stays 0
+    margin = SSIM_WINDOW // 2
+    expected = np.clip((1 - ssim) * 255, 0, 255).astype(np.uint8)
+    inner = metrics.error_map[margin:height - margin, margin:24 - margin]
+    assert np.abs(inner.astype(int) - expected).max() <= 1
+    assert not metrics.error_map[:margin].any() and not metrics.error_map[height - margin:].any()
+
+
+def test_more_noise_scores_lower():
+    reference = gradient(64, 64)
+    slight = compare_images(Image.fromarray(reference), Image.fromarray(noisy(reference, amount=4)))
+    strong = compare_images(Image.fromarray(reference), Image.fromarray(noisy(reference, amount=30)))
+
+    assert slight.psnr > strong.psnr
+    assert 1 > slight.ssim > strong.ssim > 0
+
+
+def test_too_small_for_ssim():
+    img = Image.new("RGB", (SSIM_WINDOW - 1, 20))
+    with pytest.raises(ValueError):
+        compare_images(img, img)
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from benchmark import make_photo, make_screenshot
+from converter_core import encode_image
+from size_estimator import estimate_webp_size
+
+# Large enough to be estimated from tiles instead of encoded, 2 * 8 * 256 * 256 pixels are encoded exactly
+SIZE = (1440, 960)
+
+
+@pytest.fixture(scope="module")
+def images():
+    rng = random.Random(3)
+    return {"photo": make_photo(SIZE, rng), "screenshot": make_screenshot(SIZE, rng)}
+
+
+@pytest.mark.parametrize("name", ["photo", "screenshot"])
+@pytest.mark.parametrize("quality, method, lossless", [(80, 4, False), (50, 6, False), (80, 2, True)])
+def test_actual_size_is_inside_range(images, name, quality, method, lossless):
+    img = images[name]
+    estimate = estimate_webp_size(img, quality, method, lossless)
+    actual = len(encode_image(img, quality, method, lossless))
+
+    assert not estimate.exact
+    assert estimate.low <= actual <= estimate.high
+    assert estimate.low < estimate.size < estimate.high
+    assert estimate.high / estimate.low < 2  # Honest, but still narrow enough to be useful
+    assert 0 < estimate.confidence < 1
+
+
+def test_small_image_is_encoded_exactly():
+    img = make_photo((400, 300), random.Random(3))
+    estimate = estimate_webp_size(img, 80, 4, False)
+
+    assert estimate.exact and estimate.confidence == 1.0
+    assert estimate.size == estimate.low == estimate.high == len(encode_image(img, 80, 4, False))
@@ -0,0 +1,78 @@
+from PIL import Image
+
+from target_size import _bracket, _candidates, find_quality_for_size
+
+
+def curve(quality, scale=1.0):
+    """Output size growing exponentially with quality and with the pixel count, like real encodes."""
+    return int(2000 * 1.04 ** quality * scale * scale)
+
+
+def fake_encoder(calls):
+    def encode(image, quality, scale):
+        calls.append((quality, scale))
+        return b'x' * curve(quality, scale)
+    return encode
+
+
+def test_finds_highest_fitting_quality():
+    img = Image.new("RGB", (100, 100))
+    for target in (curve(10), curve(37), curve(37) + 1, curve(99) - 1, curve(100)):
+        calls = []
+        result = find_quality_for_size(img, target, encode=fake_encoder(calls))
+
+        expected = max(q for q in range(10, 101) if curve(q) <= target)
+        assert (result.quality, result.scale, result.fits) == (expected, 1.0, True)
+        assert len(result.data) == curve(expected)
+        assert result.encodes == len(calls) < 20  # Far fewer than trying every quality
+
+
+def test_downscales_when_min_quality_is_too_big():
+    img = Image.new("RGB", (400, 300))
+    target = curve(10) // 3
+
+    result = find_quality_for_size(img, target, encode=fake_encoder([]))
+
+    assert result.fits and result.scale < 1.0
+    assert len(result.data) <= target
+    assert result.size == (round(400 * result.scale), round(300 * result.scale))
+
+
+def test_reports_when_nothing_fits():
+    def encode(image, quality, scale):
+        return b'x' * curve(quality)  # Doesn't get smaller with the image
+
+    result = find_quality_for_size(Image.new("RGB", (50, 50)), curve(10) - 1, encode=encode, max_downscales=2)
+
+    assert not result.fits and result.quality == 10 and result.scale < 1.0
+
+
+def test_shared_sizes_skip_known_probes():
+    img = Image.new("RGB", (100, 100))
+    sizes = {}
+    find_quality_for_size(img, curve(50), encode=fake_encoder([]), sizes=sizes)
+    calls = []
+
+    result = find_quality_for_size(img, curve(50), encode=fake_encoder(calls), sizes=sizes)
+
+    assert result.quality == 50
+    assert calls == [(50, 1.0)]  # Only the bytes of the answer are encoded again
+
+
+def test_bracket():
+    sizes = {(q, 1.0): curve(q) for q in (10, 30, 55, 80, 100)}
+    sizes[(40, 0.5)] = 1  # Other scales are ignored
+
+    assert _bracket(sizes, 1.0, curve(60), 10, 100) == (55, 80)
+    assert _bracket(sizes, 1.0, curve(100), 10, 100) == (100, None)
+    assert _bracket(sizes, 1.0, curve(60), 10, 55) == (55, None)
+
+
+def test_candidates_are_inside_the_bracket():
+    target = curve(60)
+    candidates = _candidates(55, 80, curve(55), curve(80), target, 3)
+
+    assert candidates == sorted(set(candidates))
+    assert all(55 < q < 80 for q in candidates)
+    assert 60 in candidates  # The log-size interpolation hits an exponential curve exactly
+    assert _candidates(20, 22, curve(20), curve(22), curve(21), 3) == [21]
@@ -0,0 +1,80 @@
+import json
+import os
+
+from PIL import Image
+
+from watch_folder import MANIFEST_NAME, FolderWatcher
+
+SETTINGS = {'quality': 80, 'method': 0, 'lossless': False, 'target_kb': None, 'max_dimension': None}
+
+
+def make_image(path, color):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", (32, 24), color).save(path)
+
+
+def run_once(root, output, settings=SETTINGS):
+    """A fresh watcher, as after a restart, that converts what's there and returns."""
+    watcher = FolderWatcher(str(root), str(output), settings, workers=1, settle=0, report=lambda line: None)
+    watcher.run(interval=0.01, once=True)
+    return watcher
+
+
+def counts(watcher):
+    return watcher.converted, watcher.skipped, watcher.failed
+
+
+def test_restart_skips_unchanged_files(tmp_path):
+    root, output = tmp_path / "in", tmp_path / "out"
+    make_image(str(root / "a.png"), (255, 0, 0))
+    make_image(str(root / "sub" / "b.jpg"), (0, 255, 0))
+
+    assert counts(run_once(root, output)) == (2, 0, 0)
+    with open(output / MANIFEST_NAME) as f:
+        entries = json.load(f)['files']
+    assert sorted(entries) == ["a.png", "sub/b.jpg"]
+    assert entries["sub/b.jpg"]['output'] == "sub/b.webp"
+    converted_at = os.stat(output / "a.webp").st_mtime_ns
+
+    assert counts(run_once(root, output)) == (0, 0, 0)
+    assert os.stat(output / "a.webp").st_mtime_ns == converted_at
+
+
+def test_touched_file_with_same_content_is_not_converted_again(tmp_path):
+    root, output = tmp_path / "in", tmp_path / "out"
+    make_image(str(root / "a.png"), (255, 0, 0))
+    run_once(root, output)
+
+    stat = os.stat(root / "a.png")
+    os.utime(root / "a.png", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert counts(run_once(root, output)) == (0, 1, 0)
+    assert counts(run_once(root, output)) == (0, 0, 0)  # The new modification time was recorded
+
+
+def test_changed_content_settings_and_missing_outputs_are_converted(tmp_path):
+    root, output = tmp_path / "in", tmp_path / "out"
+    make_image(str(root / "a.png"), (255, 0, 0))
+    make_image(str(root / "b.png"), (0, 0, 255))
+    run_once(root, output)
+
+    make_image(str(root / "a.png"), (0, 0, 0))
+    assert counts(run_once(root, output)) == (1, 0, 0)
+
+    os.remove(output / "b.webp")
+    assert counts(run_once(root, output)) == (1, 0, 0)
+
+    assert counts(run_once(root, output, dict(SETTINGS, quality=50))) == (2, 0, 0)
+
+
+def test_deleted_sources_leave_the_manifest(tmp_path):
+    root, output = tmp_path / "in", tmp_path / "out"
+    make_image(str(root / "a.png"), (255, 0, 0))
+    make_image(str(root / "b.png"), (0, 0, 255))
+    run_once(root, output)
+
+    os.remove(root / "b.png")
+    run_once(root, output)
+
+    with open(output / MANIFEST_NAME) as f:
+        assert sorted(json.load(f)['files']) == ["a.png"]
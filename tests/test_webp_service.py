@@ -0,0 +1,157 @@
+import http.client
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from webp_service import ConversionService, make_server
+
+
+class GatedPool:
+    """Stand-in for the process pool: conversions run in threads, but only once the gate is opened."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.submitted = 0
+        self._threads = ThreadPoolExecutor(max_workers=4)
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+
+        def run():
+            self.gate.wait(10)
+            return fn(*args)
+        return self._threads.submit(run)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.gate.set()
+        self._threads.shutdown(wait=wait)
+
+
+def png_bytes(color=(30, 120, 200)):
+    buffer = io.BytesIO()
+    Image.new("RGB", (48, 32), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def start(workers, max_queue, gated=False):
+    service = ConversionService(workers=workers, max_queue=max_queue)
+    if gated:
+        service._pool.shutdown()
+        service._pool = GatedPool()
+    server = make_server('127.0.0.1', 0, service)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def make(workers=1, max_queue=0, gated=False):
+        server = start(workers, max_queue, gated)
+        started.append(server)
+        return server
+    yield make
+    for server in started:
+        server.shutdown()
+        server.service.shutdown()
+        server.server_close()
+
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=15)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def post(server, body, query="quality=80&method=0"):
+    return request(server, 'POST', f"/convert?{query}", body)
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 10
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_converts_and_caches(servers):
+    server = servers()
+    status, headers, body = post(server, png_bytes())
+    assert status == 200 and headers['Content-Type'] == 'image/webp'
+    assert body[:4] == b'RIFF' and body[8:12] == b'WEBP'
+    assert headers['X-Cache'] == 'miss'
+
+    status, headers, cached = post(server, png_bytes())
+    assert (status, headers['X-Cache'], cached) == (200, 'hit', body)
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/convert?quality=101", png_bytes()),
+    ("/convert?quality=high", png_bytes()),
+    ("/convert?colour=red", png_bytes()),
+    ("/convert?target_kb=0", png_bytes()),
+    ("/convert", b""),
+])
+def test_bad_requests(servers, path, body):
+    status, _, _ = request(servers(), 'POST', path, body)
+    assert status == 400
+
+
+def test_not_an_image(servers):
+    server = servers()
+    status, _, _ = post(server, b"this is not an image" * 10)
+    assert status == 415
+    # The service keeps working afterwards
+    assert post(server, png_bytes())[0] == 200
+    # Requests are counted after their response is sent
+    wait_until(lambda: server.service.metrics()['requests'] == {'200': 1, '415': 1})
+
+
+def test_rejects_when_queue_is_full(servers):
+    server = servers(workers=1, max_queue=1, gated=True)
+    pool = server.service._pool
+    results = []
+    # One conversion runs and one waits, both block until the gate opens
+    threads = [threading.Thread(target=lambda c=c: results.append(post(server, png_bytes(c))))
+               for c in ((1, 2, 3), (4, 5, 6))]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: server.service.metrics()['in_flight'] == 2)
+
+    status, headers, _ = post(server, png_bytes((7, 8, 9)))
+    assert status == 429 and headers['Retry-After'] == '1'
+
+    pool.gate.set()
+    for thread in threads:
+        thread.join()
+    assert [status for status, _, _ in results] == [200, 200]
+    wait_until(lambda: server.service.metrics()['in_flight'] == 0)
+    metrics = json.loads(request(server, 'GET', '/metrics')[2])
+    assert metrics['rejected'] == 1 and metrics['queue_depth'] == 0
+
+
+def test_identical_requests_share_a_conversion(servers):
+    server = servers(workers=4, max_queue=0, gated=True)
+    pool = server.service._pool
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(post(server, png_bytes()))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: server.service.coalesced == 2)
+
+    pool.gate.set()
+    for thread in threads:
+        thread.join()
+    assert pool.submitted == 1
+    assert [status for status, _, _ in results] == [200] * 3
+    assert results[0][2] == results[1][2] == results[2][2]
@@ -0,0 +1,105 @@
+"""Persistent on-disk cache of the small thumbnails shown in the session strip."""
+import hashlib
+import os
+import threading
+
+from PIL import ImageOps
+
+from converter_core import encode_image, load_draft
+from image_cache import source_key
+from timing import span
+
+# Longest side of a thumbnail in pixels, they are stored as WebP at this quality
+THUMBNAIL_SIZE = 128
+THUMBNAIL_QUALITY = 75
+# Disk space for thumbnails, can be overridden with IMAGE_CONVERTER_THUMBNAIL_CACHE_MB
+DEFAULT_THUMBNAIL_CACHE_MB = 64
+
+
+def default_directory():
+    """Per-user cache directory, can be overridden with IMAGE_CONVERTER_THUMBNAIL_DIR."""
+    base = (os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+            or os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "image_converter2webp", "thumbnails")
+
+
+def make_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """WebP bytes of an image reduced to fit size x size, JPEGs are decoded at a reduced scale."""
+    img, _ = load_draft(image_path, (size, size))
+    with span("thumbnail", file=os.path.basename(image_path)):
+        if max(img.size) > size:
+            img = ImageOps.contain(img, (size, size))
+        return encode_image(img, THUMBNAIL_QUALITY, 4, False)
+
+
+class ThumbnailCache:
+    """Thumbnails stored as files named after a hash of the source path, modification time and size.
+
+    A modified source gets a new name, so entries never go stale, prune() removes the least recently used ones.
+    Safe to use from several threads, files are written atomically.
+    """
+
+    def __init__(self, directory, max_bytes, size=THUMBNAIL_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, image_path):
+        digest = hashlib.sha1(repr((source_key(image_path), self.size)).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".webp")
+
+    def thumbnail(self, image_path):
+        """WebP bytes of the thumbnail, read from disk or made from the source and stored."""
+        cache_path = self.path(image_path)
+        try:
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+            os.utime(cache_path)  # Recently used, kept by prune()
+            with self._lock:
+                self.hits += 1
+            return data
+        except OSError:
+            pass
+        with self._lock:
+            self.misses += 1
+        data = make_thumbnail(image_path, self.size)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temporary = f"{cache_path}.{threading.get_ident()}.tmp"
+            with open(temporary, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, cache_path)
+        except OSError:
+            pass  # Read-only or full disk, the thumbnail is made again next time
+        return data
+
+    def prune(self):
+        """Delete the least recently used thumbnails until the cache fits max_bytes, returns the bytes freed."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in sorted(entries):
+            if used - freed <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                freed += size
+            except OSError:
+                continue
+        return freed
+
+
+thumbnail_cache = ThumbnailCache(
+    os.environ.get("IMAGE_CONVERTER_THUMBNAIL_DIR") or default_directory(),
+    int(os.environ.get("IMAGE_CONVERTER_THUMBNAIL_CACHE_MB", DEFAULT_THUMBNAIL_CACHE_MB)) * 1024 * 1024)
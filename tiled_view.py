@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from time import perf_counter
+
+from PyQt6.QtCore import Qt, QRect, QRectF, QSize
+from PyQt6.QtGui import QPainter, QPixmap
+from PyQt6.QtWidgets import QWidget
+
+from timing import recorder, span
+
+# Screen tiles are this many pixels square, at most TILE_CACHE_SIZE of them are kept (~64 MB)
+TILE_SIZE = 256
+TILE_CACHE_SIZE = 256
+
+
+class MipPyramid:
+    """Full size image plus half size levels below it, built on first use."""
+
+    def __init__(self, image):
+        self.levels = [image]
+        self._shared = True  # levels[0] is the caller's image, it's copied before the first patch
+
+    @property
+    def size(self):
+        return self.levels[0].size()
+
+    def level_for(self, zoom):
+        """Smallest level that is still at least as large as the image at zoom, returns (level index, level scale)."""
+        index = 0
+        scale = 1.0
+        while scale / 2 >= zoom and min(self.levels[index].width(), self.levels[index].height()) > 1:
+            index += 1
+            scale /= 2
+            if index == len(self.levels):
+                previous = self.levels[index - 1]
+                with span("mip level", level=index):
+                    self.levels.append(previous.scaled(max(1, previous.width() // 2), max(1, previous.height() // 2),
+                                                       Qt.AspectRatioMode.IgnoreAspectRatio,
+                                                       Qt.TransformationMode.SmoothTransformation))
+        return index, scale
+
+    def patch(self, x, y, image, scale=1.0):
+        """Draw image at (x, y) of the full size image and into every level that was built already.
+
+        scale is the size of the full size image relative to the coordinates and the patch. The caller's image
+        is copied first, it may be shown by another view as well.
+        """
+        if self._shared:
+            self.levels[0] = self.levels[0].copy()
+            self._shared = False
+        for level in self.levels:
+            painter = QPainter(level)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawImage(QRectF(x * scale, y * scale, image.width() * scale, image.height() * scale), image)
+            painter.end()
+            scale /= 2
+
+
+class TiledImageView(QWidget):
+    """Image view that paints only the tiles inside the exposed area, at any zoom.
+
+    Memory and time depend on the screen size, not on the image size times zoom: tiles are rendered from the
+    mip level closest to the zoom and cached in a small LRU.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pyramid = None
+        self._zoom = 1.0
+        self._image_scale = 1.0  # Image pixels per logical pixel, below 1 while a reduced resolution draft is shown
+        self._tiles = OrderedDict()  # (level, zoom, column, row) -> QPixmap
+        self._zoom_started = None  # Time of the zoom change the next paint completes
+        self._overlay = None  # Image stretched over the whole view, e.g. a difference heatmap
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent, False)
+
+    def image(self):
+        return self._pyramid.levels[0] if self._pyramid else None
+
+    def set_image(self, image, logical_size=None):
+        """Show image, logical_size is the size it stands for when it's a reduced resolution draft."""
+        self._pyramid = MipPyramid(image) if image is not None and not image.isNull() else None
+        self._image_scale = image.width() / logical_size.width() if self._pyramid and logical_size else 1.0
+        self._tiles.clear()
+        self._update_size()
+
+    def set_overlay(self, image):
+        """Draw image stretched over the view on top of the tiles, None removes it."""
+        self._overlay = image
+        self.update()
+
+    def logical_size(self):
+        if self._pyramid is None:
+            return QSize(0, 0)
+        size = self._pyramid.size
+        return QSize(round(size.width() / self._image_scale), round(size.height() / self._image_scale))
+
+    def set_zoom(self, zoom):
+        if zoom != self._zoom:
+            self._zoom = zoom
+            self._zoom_started = perf_counter()
+            self._tiles.clear()
+            self._update_size()
+
+    def patch(self, x, y, image):
+        """Replace a region of the image (in image pixels), used to show parts of the image as they arrive."""
+        if self._pyramid is None:
+            return
+        self._pyramid.patch(x, y, image, self._image_scale)
+        self._tiles.clear()
+        self.update(QRect(int(x * self._zoom), int(y * self._zoom),
+                          int(image.width() * self._zoom) + 2, int(image.height() * self._zoom) + 2))
+
+    def _update_size(self):
+        if self._pyramid is None:
+            self.setFixedSize(QSize(0, 0))
+        else:
+            size = self.logical_size()
+            self.setFixedSize(max(1, round(size.width() * self._zoom)), max(1, round(size.height() * self._zoom)))
+        self.update()
+
+    def paintEvent(self, event):
+        if self._pyramid is None:
+            return
+        exposed = event.rect()
+        start = perf_counter()
+        painter = QPainter(self)
+        for row in range(exposed.top() // TILE_SIZE, exposed.bottom() // TILE_SIZE + 1):
+            for col in range(exposed.left() // TILE_SIZE, exposed.right() // TILE_SIZE + 1):
+                tile = self._tile(col, row)
+                if tile is not None:
+                    painter.drawPixmap(col * TILE_SIZE, row * TILE_SIZE, tile)
+        if self._overlay is not None:
+            painter.setClipRect(exposed)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawImage(QRectF(0, 0, self.width(), self.height()), self._overlay)
+        painter.end()
+        end = perf_counter()
+        recorder.add("paint", start, end)
+        if self._zoom_started is not None:
+            recorder.add("zoom", self._zoom_started, end, {'zoom': self._zoom})
+            self._zoom_started = None
+
+    def _tile(self, col, row):
+        zoom = self._zoom * self._image_scale  # Zoom relative to the image held
+        level, level_scale = self._pyramid.level_for(zoom)
+        key = (level, zoom, col, row)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        width = min(TILE_SIZE, self.width() - col * TILE_SIZE)
+        height = min(TILE_SIZE, self.height() - row * TILE_SIZE)
+        if width <= 0 or height <= 0:
+            return None
+
+        # Tile in widget pixels -> rectangle of the mip level
+        factor = zoom / level_scale
+        source = QRectF(col * TILE_SIZE / factor, row * TILE_SIZE / factor, width / factor, height / factor)
+        with span("tile render"):
+            tile = QPixmap(width, height)
+            tile.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(tile)
+            # Zoomed in pixels are shown as sharp squares to judge compression artifacts
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, factor < 1)
+            painter.drawImage(QRectF(0, 0, width, height), self._pyramid.levels[level], source)
+            painter.end()
+
+        self._tiles[key] = tile
+        while len(self._tiles) > TILE_CACHE_SIZE:
+            self._tiles.popitem(last=False)
+        return tile
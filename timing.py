@@ -0,0 +1,90 @@
+"""Per-stage timing spans with rolling percentiles and an optional Chrome trace export.
+
+Set IMAGE_CONVERTER_TRACE to a file name to record every span, the GUI writes the trace when it's closed.
+Open it in chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+# Durations kept per span name for the rolling percentiles, and the most trace events kept in memory
+ROLLING_WINDOW = 200
+MAX_TRACE_EVENTS = 200_000
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class SpanRecorder:
+    """Collects named spans from any thread: rolling durations per name, plus trace events when tracing."""
+
+    def __init__(self, window=ROLLING_WINDOW, trace_path=None):
+        self.trace_path = trace_path
+        self._window = window
+        self._lock = threading.Lock()
+        self._durations = {}  # name -> deque of the last durations in seconds
+        self._events = deque(maxlen=MAX_TRACE_EVENTS) if trace_path else None
+        self._threads = {}  # thread id -> thread name, for the trace
+        self._origin = perf_counter()
+
+    @contextmanager
+    def span(self, name, **args):
+        """Time the block as a span called name, args are shown with the span in the trace."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, perf_counter(), args)
+
+    def add(self, name, start, end, args=None):
+        """Record a span measured elsewhere, start and end are perf_counter() values."""
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = deque(maxlen=self._window)
+            durations.append(end - start)
+            if self._events is not None:
+                thread = threading.current_thread()
+                self._threads.setdefault(thread.ident, thread.name)
+                event = {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                         'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6}
+                if args:
+                    event['args'] = {key: str(value) for key, value in args.items()}
+                self._events.append(event)
+
+    def stats(self):
+        """{name: (count, p50 ms, p95 ms)} over the rolling window of every span name."""
+        with self._lock:
+            snapshot = {name: list(durations) for name, durations in self._durations.items()}
+        return {name: (len(values), percentile(values, 50) * 1000, percentile(values, 95) * 1000)
+                for name, values in snapshot.items()}
+
+    def write_trace(self, path=None):
+        """Write the recorded spans as Chrome trace-event JSON, returns the path or None when not tracing."""
+        path = path or self.trace_path
+        if self._events is None or not path:
+            return None
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                      for tid, name in self._threads.items()]
+            events.extend(self._events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+
+recorder = SpanRecorder(trace_path=os.environ.get("IMAGE_CONVERTER_TRACE") or None)
+
+
+def span(name, **args):
+    """Time a block with the module recorder: with span("encode", quality=80): ..."""
+    return recorder.span(name, **args)
@@ -0,0 +1,252 @@
+"""Watch a directory tree and convert new or changed JPG/PNG/BMP/GIF images to WEBP.
+
+Usage: python watch_folder.py incoming/ -o webp/ -q 80 -m 6
+
+A manifest of content hashes and settings is kept next to the output (.webp_manifest.json), files that didn't
+change are skipped without decoding them, also after a restart. The tree is polled, a file is converted once its
+size and modification time stayed the same for --settle seconds, so a burst of writes converts it once.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from time import monotonic, sleep
+
+from batch_convert import _convert_job
+from converter_core import add_encoder_arguments, output_path
+
+# WebP files in the tree are outputs or already converted, they are never watched
+WATCHED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+MANIFEST_NAME = '.webp_manifest.json'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    """SHA-256 of the file content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan(root, exclude=None):
+    """{path: (mtime_ns, size)} of every watched image under root, exclude is a directory that is skipped."""
+    found = {}
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue  # Removed while scanning
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if exclude is None or os.path.abspath(entry.path) != exclude:
+                        directories.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in WATCHED_EXTENSIONS:
+                    stat = entry.stat()
+                    found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+    return found
+
+
+class Manifest:
+    """Source files converted so far: relative path -> content hash, stat, settings and output.
+
+    Saved atomically, so a crash leaves the previous version and the next start resumes from it.
+    """
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f).get('files', {})
+
+    def key(self, source):
+        return os.path.relpath(source, self.root).replace(os.sep, '/')
+
+    def get(self, source):
+        return self.entries.get(self.key(source))
+
+    def put(self, source, **entry):
+        self.entries[self.key(source)] = entry
+        self.dirty = True
+
+    def remove_missing(self, sources):
+        keys = {self.key(source) for source in sources}
+        for key in [key for key in self.entries if key not in keys]:
+            del self.entries[key]
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'files': self.entries}, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+        self.dirty = False
+
+
+def is_up_to_date(entry, stat, settings, save_path):
+    """True when the manifest says the file with this stat was converted with these settings."""
+    return (entry is not None and entry.get('mtime_ns') == stat[0] and entry.get('size') == stat[1]
+            and entry.get('settings') == settings and (entry.get('error') or os.path.exists(save_path)))
+
+
+class FolderWatcher:
+    """Converts new and changed images under root with a process pool, see the module docstring."""
+
+    def __init__(self, root, output_dir, settings, workers=None, settle=2.0, manifest_path=None, report=print):
+        self.root = os.path.abspath(root)
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        self.settings = settings
+        self.workers = workers or os.cpu_count() or 1
+        self.settle = settle
+        self.report = report
+        self.manifest = Manifest(manifest_path or os.path.join(self.output_dir or self.root, MANIFEST_NAME),
+                                 self.root)
+        self._pending = {}  # source -> (stat, time it was last seen changing)
+        self._running = {}  # future -> (source, stat, content hash)
+        self.converted = self.skipped = self.failed = 0
+
+    def save_path(self, source):
+        return output_path(source, self.root, self.output_dir)
+
+    def poll(self, pool):
+        """Scan once, start conversions of settled files and record finished ones."""
+        now = monotonic()
+        files = scan(self.root, self.output_dir)
+        self.manifest.remove_missing(files)
+        running = {source for source, _, _ in self._running.values()}
+        for source, stat in files.items():
+            if source in running:
+                continue  # Looked at again when its conversion is done
+            if is_up_to_date(self.manifest.get(source), stat, self.settings, self.save_path(source)):
+                self._pending.pop(source, None)
+                continue
+            pending = self._pending.get(source)
+            if pending is None or pending[0] != stat:
+                self._pending[source] = (stat, now)  # Every change restarts the settle time
+        for source in [source for source in self._pending if source not in files]:
+            del self._pending[source]  # Deleted before it settled
+
+        for source, (stat, changed) in list(self._pending.items()):
+            if len(self._running) >= self.workers * 2:
+                break
+            if now - changed < self.settle:
+                continue
+            del self._pending[source]
+            self._start(pool, source, stat)
+        self._collect(wait(self._running, timeout=0)[0])
+
+    def _start(self, pool, source, stat):
+        try:
+            content_hash = file_hash(source)
+        except OSError:
+            return  # Removed or locked, the next scan tries again
+        entry = self.manifest.get(source)
+        save_path = self.save_path(source)
+        if (entry and entry.get('sha256') == content_hash and entry.get('settings') == self.settings
+                and (entry.get('error') or os.path.exists(save_path))):
+            # Touched or copied over with the same content, nothing to decode
+            self.manifest.put(source, **dict(entry, mtime_ns=stat[0], size=stat[1]))
+            self.skipped += 1
+            return
+        settings = self.settings
+        future = pool.submit(_convert_job, source, save_path, settings['quality'], settings['method'],
+                             settings['lossless'], settings['target_kb'], settings['max_dimension'])
+        self._running[future] = (source, stat, content_hash)
+
+    def _collect(self, done):
+        for future in done:
+            source, stat, content_hash = self._running.pop(future)
+            image_path, save_path, in_size, out_size, seconds, error, detail, peak_mb, _ = future.result()
+            try:
+                current = os.stat(source)
+            except OSError:
+                continue  # Deleted meanwhile
+            if (current.st_mtime_ns, current.st_size) != stat:
+                continue  # Changed while converting, converted again once it settles
+            output = os.path.relpath(save_path, os.path.dirname(self.manifest.path)).replace(os.sep, '/')
+            self.manifest.put(source, sha256=content_hash, mtime_ns=stat[0], size=stat[1], settings=self.settings,
+                              output=output, output_size=out_size, error=error)
+            if error:
+                self.failed += 1
+                self.report(f"FAILED {image_path}: {error}")
+            else:
+                self.converted += 1
+                detail = f", {detail}" if detail else ''
+                self.report(f"{image_path} -> {save_path} {in_size / 1024:.1f} KB -> {out_size / 1024:.1f} KB "
+                            f"({seconds * 1000:.0f} ms{detail})")
+        self.manifest.save()
+
+    @property
+    def idle(self):
+        return not self._pending and not self._running
+
+    def run(self, interval=1.0, once=False):
+        """Watch until interrupted, with once return as soon as everything present at the start is converted."""
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while True:
+                    self.poll(pool)
+                    if once and self.idle:
+                        break
+                    if self._running:
+                        # Sleep until a conversion finishes or the next scan is due
+                        self._collect(wait(self._running, timeout=interval, return_when=FIRST_COMPLETED)[0])
+                    else:
+                        sleep(interval)
+            except KeyboardInterrupt:
+                pool.shutdown(wait=False, cancel_futures=True)
+            finally:
+                self.manifest.save()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Watch a folder and convert new or changed JPG/PNG/BMP/GIF "
+                                                 "images to WEBP.")
+    parser.add_argument('folder', help="directory to watch, subdirectories included")
+    parser.add_argument('-o', '--output-dir', help="output directory, default is next to the source file")
+    add_encoder_arguments(parser, jobs_help="worker processes")
+    parser.add_argument('--target-kb', type=float, default=None,
+                        help="pick the highest quality that fits this size in KB (overrides -q and --lossless)")
+    parser.add_argument('--max-dimension', type=int, default=None,
+                        help="downscale images whose longest side is larger than this many pixels")
+    parser.add_argument('--interval', type=float, default=1.0, help="seconds between scans (default 1)")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="seconds a file must stay unchanged before it's converted (default 2)")
+    parser.add_argument('--manifest', help=f"manifest file (default: {MANIFEST_NAME} in the output directory)")
+    parser.add_argument('--once', action='store_true', help="convert what's there and exit instead of watching")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.isdir(args.folder):
+        print(f"Not a directory: {args.folder}")
+        return 2
+    settings = {'quality': args.quality, 'method': args.method, 'lossless': args.lossless,
+                'target_kb': args.target_kb, 'max_dimension': args.max_dimension}
+    watcher = FolderWatcher(args.folder, args.output_dir, settings, workers=args.jobs,
+                            settle=0 if args.once else args.settle, manifest_path=args.manifest)
+    if not args.once:
+        print(f"Watching {watcher.root}, press Ctrl+C to stop")
+    watcher.run(args.interval, once=args.once)
+    print(f"Converted: {watcher.converted}, unchanged content: {watcher.skipped}, failed: {watcher.failed}")
+    return 1 if watcher.failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
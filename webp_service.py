@@ -0,0 +1,409 @@
+"""Local HTTP conversion service: POST image bytes, get WebP bytes back.
+
+Usage: python webp_service.py --port 8765 --workers 4
+       curl --data-binary @photo.jpg "http://127.0.0.1:8765/convert?quality=80&method=4" -o photo.webp
+       python webp_service.py --load-test photo.jpg --requests 200 --concurrency 8
+
+POST /convert takes the image as the request body and quality, method, lossless, target_kb and max_dimension as
+query parameters. Bodies are streamed to a temporary file and hashed while they are read, the conversion runs in
+a bounded process pool that answers 429 when its queue is full. Results are cached by content hash and
+parameters, identical requests arriving while one is converted share that conversion. GET /metrics returns queue
+depth, latency percentiles and throughput as JSON.
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, perf_counter
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import UnidentifiedImageError
+
+from animation import animation_to_webp, is_animated
+from converter_core import encode_image, load_image
+from image_cache import EncodedCache
+from target_size import find_quality_for_size
+from timing import SpanRecorder, percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+# Conversions waiting for a worker before new ones get 429, per worker
+DEFAULT_QUEUE_PER_WORKER = 4
+DEFAULT_CACHE_MB = 256
+DEFAULT_MAX_UPLOAD_MB = 100
+READ_CHUNK_SIZE = 64 * 1024
+# Completed requests per second are measured over this many seconds
+THROUGHPUT_WINDOW = 60
+
+
+class RequestError(Exception):
+    """Rejected request, turned into an HTTP error response."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_params(query):
+    """Conversion parameters of a query string, (quality, method, lossless, target_kb, max_dimension)."""
+    values = {key: items[-1] for key, items in parse_qs(query).items()}
+    unknown = set(values) - {'quality', 'method', 'lossless', 'target_kb', 'max_dimension'}
+    if unknown:
+        raise RequestError(400, f"unknown parameter: {', '.join(sorted(unknown))}")
+    try:
+        quality = int(values.get('quality', 80))
+        method = int(values.get('method', 4))
+        lossless = values.get('lossless', '0').lower() in ('1', 'true', 'yes')
+        target_kb = float(values['target_kb']) if 'target_kb' in values else None
+        max_dimension = int(values['max_dimension']) if 'max_dimension' in values else None
+    except ValueError as e:
+        raise RequestError(400, f"invalid parameter: {e}")
+    if not 0 <= quality <= 100 or not 0 <= method <= 6:
+        raise RequestError(400, "quality must be 0-100 and method 0-6")
+    if (target_kb is not None and target_kb <= 0) or (max_dimension is not None and max_dimension <= 0):
+        raise RequestError(400, "target_kb and max_dimension must be positive")
+    return quality, method, lossless, target_kb, max_dimension
+
+
+def _convert_upload(image_path, quality, method, lossless, target_kb, max_dimension):
+    """Runs in a worker process, returns the WebP bytes of an uploaded file."""
+    if is_animated(image_path):
+        return animation_to_webp(image_path, quality, method, lossless)
+    img = load_image(image_path, max_dimension)
+    if target_kb:
+        return find_quality_for_size(img, target_kb * 1024, method).data
+    return encode_image(img, quality, method, lossless)
+
+
+class ConversionService:
+    """Bounded process pool with a result cache and request statistics, shared by the request handler threads."""
+
+    def __init__(self, workers=None, max_queue=None, cache_bytes=DEFAULT_CACHE_MB * 1024 * 1024,
+                 max_upload_bytes=DEFAULT_MAX_UPLOAD_MB * 1024 * 1024):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = DEFAULT_QUEUE_PER_WORKER * self.workers if max_queue is None else max_queue
+        self.max_upload_bytes = max_upload_bytes
+        self.cache = EncodedCache(cache_bytes)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._lock = threading.Lock()
+        self._admitted = 0  # Requests holding a slot of the pool, running or queued
+        self._converting = {}  # cache key -> future of the conversion, shared by identical requests
+        self.latency = SpanRecorder(window=1000)
+        self._completed = deque()  # monotonic() times of completed requests for the throughput
+        self.statuses = Counter()
+        self.coalesced = 0
+        self.bytes_in = self.bytes_out = 0
+        self._started = monotonic()
+
+    def admit(self):
+        """Reserve a pool slot, False when workers and queue are all taken."""
+        with self._lock:
+            if self._admitted >= self.workers + self.max_queue:
+                return False
+            self._admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._admitted -= 1
+
+    def convert(self, image_path, content_hash, params):
+        """WebP bytes for an uploaded file and whether they came from the cache, the caller holds a slot."""
+        key = (content_hash,) + params
+        webp_data = self.cache.get(key)
+        if webp_data is not None:
+            return webp_data, True
+        with self._lock:
+            future = self._converting.get(key)
+            owner = future is None
+            if owner:
+                future = self._converting[key] = self._pool.submit(_convert_upload, image_path, *params)
+            else:
+                self.coalesced += 1
+        try:
+            webp_data = future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    del self._converting[key]
+        if owner:
+            self.cache.put(key, webp_data)
+        return webp_data, False
+
+    def record(self, status, start, bytes_in=0, bytes_out=0):
+        end = perf_counter()
+        with self._lock:
+            self.statuses[status] += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if status == 200:
+                self._completed.append(monotonic())
+        if status == 200:
+            self.latency.add("convert", start, end)
+
+    def metrics(self):
+        now = monotonic()
+        with self._lock:
+            while self._completed and now - self._completed[0] > THROUGHPUT_WINDOW:
+                self._completed.popleft()
+            window = min(THROUGHPUT_WINDOW, now - self._started) or 1
+            completed = len(self._completed)
+            admitted = self._admitted
+            statuses = dict(self.statuses)
+        count, p50, p95 = self.latency.stats().get("convert", (0, 0.0, 0.0))
+        return {
+            'workers': self.workers,
+            'in_flight': admitted,
+            'queue_depth': max(0, admitted - self.workers),
+            'max_queue': self.max_queue,
+            'latency_ms': {'p50': round(p50, 1), 'p95': round(p95, 1), 'samples': count},
+            'throughput_per_s': round(completed / window, 2),
+            'requests': {str(status): total for status, total in sorted(statuses.items())},
+            'rejected': statuses.get(429, 0),
+            'cache': {'hits': self.cache.hits, 'misses': self.cache.misses, 'entries': len(self.cache),
+                      'bytes': self.cache.used_bytes},
+            'coalesced': self.coalesced,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'uptime_s': round(now - self._started, 1),
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, every response has a Content-Length
+    server_version = "WebPService"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        if self.headers.get('Content-Length', '0') != '0' or 'Transfer-Encoding' in self.headers:
+            self.close_connection = True  # A body that isn't read can't be left for the next request
+        if urlsplit(self.path).path == '/metrics':
+            self._send(200, json.dumps(self.service.metrics(), indent=1).encode(), 'application/json')
+        else:
+            self._send(404, b"not found\n")
+
+    def do_POST(self):
+        start = perf_counter()
+        url = urlsplit(self.path)
+        admitted = body_read = False
+        length = 0
+        try:
+            if url.path != '/convert':
+                raise RequestError(404, "not found")
+            params = parse_params(url.query)
+            length = self._content_length()
+            admitted = self.service.admit()
+            if not admitted:
+                raise RequestError(429, "conversion queue is full, retry later")
+            upload_path, content_hash = self._receive(length)
+            body_read = True
+            try:
+                webp_data, cached = self.service.convert(upload_path, content_hash, params)
+            finally:
+                os.remove(upload_path)
+        except RequestError as e:
+            self._error(e.status, str(e), start, body_read)
+        except UnidentifiedImageError:
+            self._error(415, "not a supported image", start, body_read)
+        except Exception as e:
+            logger.exception("Conversion failed")
+            self._error(500, f"conversion failed: {e}", start, body_read)
+        else:
+            self._send(200, webp_data, 'image/webp', {'X-Cache': 'hit' if cached else 'miss',
+                                                      'X-Convert-Ms': f"{(perf_counter() - start) * 1000:.1f}"})
+            self.service.record(200, start, length, len(webp_data))
+        finally:
+            if admitted:
+                self.service.release()
+
+    def _content_length(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            raise RequestError(411, "chunked bodies aren't supported, send a Content-Length")
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            raise RequestError(411, "Content-Length required")
+        if length <= 0:
+            raise RequestError(400, "empty body")
+        if length > self.service.max_upload_bytes:
+            raise RequestError(413, f"body larger than {self.service.max_upload_bytes // 1024 // 1024} MB")
+        return length
+
+    def _receive(self, length):
+        """Stream the body into a temporary file for the worker process, hashing it on the way.
+
+        Returns (path, SHA-256 hex digest). Only one chunk of the body is in memory at a time.
+        """
+        digest = hashlib.sha256()
+        buffer = bytearray(READ_CHUNK_SIZE)
+        view = memoryview(buffer)
+        remaining = length
+        f = tempfile.NamedTemporaryFile(prefix='webp_service_', delete=False)
+        try:
+            with f:
+                while remaining:
+                    read = self.rfile.readinto(view[:min(remaining, READ_CHUNK_SIZE)])
+                    if not read:
+                        raise RequestError(400, "body shorter than Content-Length")
+                    digest.update(view[:read])
+                    f.write(view[:read])
+                    remaining -= read
+        except BaseException:
+            os.remove(f.name)
+            raise
+        return f.name, digest.hexdigest()
+
+    def _error(self, status, message, start, body_read):
+        if not body_read:
+            # The rest of the body would be parsed as the next request, the connection can't be reused
+            self.close_connection = True
+        self._send(status, (message + "\n").encode(), extra={'Retry-After': '1'} if status == 429 else None)
+        self.service.record(status, start)
+
+    def _send(self, status, body, content_type='text/plain; charset=utf-8', extra=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def make_server(host, port, service):
+    server = ThreadingHTTPServer((host, port), ConversionHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def load_test(host, port, image_path, requests, concurrency, query, vary_quality=False):
+    """Send requests POSTs of an image from concurrency threads, returns a summary dict.
+
+    With vary_quality every request asks for another quality, so the result cache can't answer them.
+    """
+    with open(image_path, 'rb') as f:
+        body = f.read()
+    local = threading.local()
+
+    def send(index):
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection(host, port, timeout=600)
+        request_query = f"{query}&quality={10 + index % 91}" if vary_quality else query
+        start = perf_counter()
+        try:
+            connection.request('POST', f"/convert?{request_query}", body=body,
+                               headers={'Content-Type': 'application/octet-stream'})
+            response = connection.getresponse()
+            response.read()
+            status, cache = response.status, response.getheader('X-Cache')
+            if response.getheader('Connection') == 'close':
+                connection.close()
+                local.connection = None
+        except OSError:
+            connection.close()
+            local.connection = None
+            status, cache = 0, None
+        return status, cache, (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(requests)))
+    wall = perf_counter() - start
+    latencies = [ms for status, _, ms in results if status == 200]
+    return {
+        'requests': requests,
+        'statuses': dict(Counter(status for status, _, _ in results)),
+        'cache_hits': sum(1 for _, cache, _ in results if cache == 'hit'),
+        'wall_s': wall,
+        'throughput_per_s': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local HTTP service converting images to WEBP.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port (default {DEFAULT_PORT})")
+    # Not add_encoder_arguments(): quality, method and lossless are parameters of every request
+    parser.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--max-queue', type=int, default=None,
+                        help=f"conversions waiting for a worker before 429 is returned "
+                             f"(default {DEFAULT_QUEUE_PER_WORKER} per worker)")
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB,
+                        help=f"memory for cached results (default {DEFAULT_CACHE_MB})")
+    parser.add_argument('--max-upload-mb', type=int, default=DEFAULT_MAX_UPLOAD_MB,
+                        help=f"largest accepted body (default {DEFAULT_MAX_UPLOAD_MB})")
+    load = parser.add_argument_group("load test")
+    load.add_argument('--load-test', metavar='IMAGE',
+                      help="start the service on a free localhost port, POST IMAGE to it and report the results")
+    load.add_argument('--url', help="load test a running service instead, e.g. http://127.0.0.1:8765")
+    load.add_argument('--requests', type=int, default=100, help="requests sent by the load test (default 100)")
+    load.add_argument('--concurrency', type=int, default=8, help="parallel clients of the load test (default 8)")
+    load.add_argument('--query', default='quality=80&method=4', help="parameters of the load test requests")
+    load.add_argument('--vary-quality', action='store_true',
+                      help="change the quality with every request so the cache can't answer them")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=os.environ.get("IMAGE_CONVERTER_LOG_LEVEL", "WARNING"))
+
+    if args.load_test and args.url:
+        url = urlsplit(args.url)
+        summary = load_test(url.hostname, url.port or 80, args.load_test, args.requests, args.concurrency,
+                            args.query, args.vary_quality)
+        print(json.dumps(summary, indent=1))
+        return 0
+
+    service = ConversionService(args.workers, args.max_queue, args.cache_mb * 1024 * 1024,
+                                args.max_upload_mb * 1024 * 1024)
+    server = make_server(args.host, 0 if args.load_test else args.port, service)
+    host, port = server.server_address[:2]
+    try:
+        if args.load_test:
+            thread = threading.Thread(target=server.serve_forever, name="webp-service", daemon=True)
+            thread.start()
+            summary = load_test(host, port, args.load_test, args.requests, args.concurrency, args.query,
+                                args.vary_quality)
+            print(json.dumps({'client': summary, 'server': service.metrics()}, indent=1))
+            return 0
+        print(f"Serving on http://{host}:{port}, POST /convert, GET /metrics, press Ctrl+C to stop")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.load_test:
+            server.shutdown()
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())